@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .models import User
+
+ADMINISTRATOR = 'Administrator'
+
+def get_auth_state_key(user_id):
+    return f'members:auth-state:{user_id}'
+
+def get_user_auth_state(user_id):
+    """
+    Returns {'found', 'is_active', 'groups'} for a user, cached for
+    AUTH_STATE_CACHE_TIMEOUT seconds when SHARED_CACHE is on, so that deactivating a user or removing
+    them from a group takes effect without a query on every request.
+    """
+    key = get_auth_state_key(user_id)
+    state = cache.get(key) if settings.SHARED_CACHE else None
+    if state is None:
+        rows = list(User.objects.filter(pk=user_id).values_list('is_active', 'groups__name'))
+        state = {
+            'found': bool(rows),
+            'is_active': bool(rows) and rows[0][0],
+            'groups': sorted(name for is_active, name in rows if name),
+        }
+        if settings.SHARED_CACHE:
+            cache.set(key, state, settings.AUTH_STATE_CACHE_TIMEOUT)
+    return state
+
+def invalidate_user_auth_state(user_id):
+    cache.delete(get_auth_state_key(user_id))
+
+def is_administrator(user):
+    # A signed Administrator role claim is enough, it was checked against the
+    # cached groups when the request was authenticated
+    if getattr(user, 'role', None) == ADMINISTRATOR:
+        return True
+    roles = getattr(user, 'roles', None)
+    if roles is None:
+        roles = get_user_auth_state(user.pk)['groups']
+    return ADMINISTRATOR in roles
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds request.user from the signed token claims
+    instead of loading the user row. Only the cached auth state is consulted,
+    to honour deactivation and revoked roles.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        state = get_user_auth_state(user_id)
+        if not state['found']:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        role = validated_token.get('role')
+        if role is not None and role not in state['groups']:
+            raise AuthenticationFailed(_("User no longer has this role"), code="role_revoked")
+
+        user = User(
+            id=user_id,
+            email=validated_token.get('email', ''),
+            full_name=validated_token.get('name', ''),
+            mobile_number=validated_token.get('mobile', ''),
+            is_active=True,
+        )
+        # Behave like a row fetched from the database, so it can be assigned to foreign keys
+        user._state.adding = False
+        user._state.db = User.objects.db
+        user.role = role
+        user.roles = state['groups']
+        return user
@@ -0,0 +1,270 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.module_loading import import_string
+from rest_framework.response import Response
+
+MEMBERS_VERSION_KEY = 'members:version'
+# A member's document is cached under each of these, so a lookup by any of them is one fetch
+MEMBER_DOCUMENT_FIELDS = ('id', 'mobile_number', 'membership_number')
+
+class LocalLRUCache:
+    """
+    In-process cache of at most MEMBER_CACHE_MAX_ENTRIES entries, the least
+    recently used entry is evicted first. Used by default and in tests.
+    """
+    def __init__(self):
+        self.max_entries = settings.MEMBER_CACHE_MAX_ENTRIES
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class DjangoCacheBackend:
+    """Entries in the MEMBER_CACHE_ALIAS cache, shared by every process. Size and eviction are the cache's own."""
+
+    def __init__(self):
+        self.cache = caches[settings.MEMBER_CACHE_ALIAS]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+class ResponseCache:
+    """Wraps a cache backend and counts hits and misses."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(key, value, settings.MEMBER_CACHE_TIMEOUT if timeout is None else timeout)
+
+    def clear(self):
+        self.backend.clear()
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
+@lru_cache(maxsize=None)
+def load_response_cache(path):
+    return ResponseCache(import_string(path)())
+
+def get_response_cache():
+    return load_response_cache(settings.MEMBER_CACHE_BACKEND)
+
+def get_members_version():
+    version = cache.get(MEMBERS_VERSION_KEY)
+    if version is None:
+        # Seeded from the clock, an evicted counter must not come back as a version used before
+        cache.add(MEMBERS_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(MEMBERS_VERSION_KEY)
+    return version
+
+def bump_members_version():
+    try:
+        cache.incr(MEMBERS_VERSION_KEY)
+    except ValueError:
+        get_members_version()
+
+def invalidate_members_cache():
+    """
+    Makes every cached member response stale. The version is bumped right away,
+    for reads in this transaction, and again on commit, so a page cached from
+    the old rows while the transaction was open is not served afterwards.
+    """
+    bump_members_version()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump_members_version)
+
+def get_response_cache_key(prefix, request, version):
+    # Parameters are sorted so the same filters in any order share an entry
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    digest = hashlib.sha1(repr((request.get_host(), request.path, params)).encode()).hexdigest()
+    return f'members:response:{prefix}:{version}:{digest}'
+
+def cache_members_response(prefix):
+    """
+    Caches a view's successful responses until the members version changes or
+    MEMBER_CACHE_TIMEOUT passes, and marks them with an X-Cache HIT or MISS header.
+    Responses are not cached at all without SHARED_CACHE.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.SHARED_CACHE:
+                return view(request, *args, **kwargs)
+            response_cache = get_response_cache()
+            # read the version before the rows, a bump in between only orphans this entry
+            key = get_response_cache_key(prefix, request, get_members_version())
+            cached = response_cache.get(key)
+            if cached is not None:
+                return Response(cached, headers={'X-Cache': 'HIT'})
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response_cache.set(key, response.data)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+def get_versioned(prefix, request, compute, get_timeout=None):
+    """
+    compute() for this request, cached until the members version changes or
+    get_timeout(value) seconds pass. Not counted in the stats.
+    """
+    if not settings.SHARED_CACHE:
+        return compute()
+    response_cache = get_response_cache()
+    key = get_response_cache_key(prefix, request, get_members_version())
+    value = response_cache.backend.get(key)
+    if value is None:
+        value = compute()
+        response_cache.set(key, value, get_timeout(value) if get_timeout else None)
+    return value
+
+def get_etag(request, fingerprint):
+    # Weak: equal fingerprints mean the same data, not byte-identical bodies
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    digest = hashlib.sha1(repr((request.path, params, sorted(fingerprint.items()))).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+def conditional_members_response(get_fingerprint):
+    """
+    Adds an ETag and Last-Modified to a view's responses from `get_fingerprint`,
+    a dict of row counts and a `last_modified` datetime that is much cheaper to
+    read than the response is to build. A matching If-None-Match or
+    If-Modified-Since is answered with a 304 before the view runs at all.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            fingerprint = get_fingerprint(request, *args, **kwargs)
+            if fingerprint is None:
+                return view(request, *args, **kwargs)
+            etag = get_etag(request, fingerprint)
+            last_modified = fingerprint['last_modified'].timestamp() if fingerprint.get('last_modified') else None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
+
+def get_member_document_key(field, value):
+    return f'members:document:{field}:{value}'
+
+def get_member_document_keys_key(member_id):
+    return f'members:document-keys:{member_id}'
+
+def get_member_document_timeout(member):
+    timeout = settings.MEMBER_CACHE_TIMEOUT
+    # is_suspended flips when the suspension ends, the document must not outlive it
+    if member.is_currently_suspended():
+        timeout = min(timeout, (member.suspended_until - timezone.now()).total_seconds())
+    return max(int(timeout), 1)
+
+def get_member_lookup_queryset(field, value):
+    from .models import Member
+    return Member.objects.for_listing().filter(soft_delete=False, **{field: value})
+
+def get_member_document(field, value):
+    """
+    The serialized member whose `field` is `value`, read through the cache
+    when SHARED_CACHE is on. Returns None when there is no such member.
+    """
+    from .models import Member
+    from .serializers import MemberSerializer
+
+    if settings.SHARED_CACHE:
+        document = cache.get(get_member_document_key(field, value))
+        # skip a document left behind under a number the member no longer has
+        if document is not None and str(document.get(field)) == str(value):
+            return document
+    try:
+        member = get_member_lookup_queryset(field, value).get()
+    except (Member.DoesNotExist, Member.MultipleObjectsReturned):
+        return None
+
+    document = MemberSerializer(member).data
+    if not settings.SHARED_CACHE:
+        return document
+    keys = [get_member_document_key(name, getattr(member, name)) for name in MEMBER_DOCUMENT_FIELDS if getattr(member, name)]
+    timeout = get_member_document_timeout(member)
+    cache.set_many({key: document for key in keys}, timeout)
+    # remembered so the entries can be dropped by member id alone
+    cache.set(get_member_document_keys_key(member.pk), keys, timeout)
+    return document
+
+def delete_member_documents(member_ids):
+    keys_keys = [get_member_document_keys_key(member_id) for member_id in member_ids]
+    keys = [key for stored in cache.get_many(keys_keys).values() for key in stored]
+    keys += [get_member_document_key('id', member_id) for member_id in member_ids]
+    cache.delete_many(keys + keys_keys)
+
+def invalidate_member_documents(member_ids):
+    """Drops the cached documents of `member_ids`, now and again on commit like invalidate_members_cache."""
+    member_ids = list(member_ids)
+    if not member_ids:
+        return
+    delete_member_documents(member_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: delete_member_documents(member_ids))
@@ -0,0 +1,14 @@
+from functools import lru_cache
+
+@lru_cache(maxsize=1024)
+def get_country_code(country_name):
+    """
+    ISO 3166 alpha-2 code of a country name, '' when pycountry does not know it.
+    Memoized per process, and pycountry is only imported on the first lookup.
+    """
+    if not country_name:
+        return ''
+    import pycountry
+
+    country = pycountry.countries.get(name=country_name.strip())
+    return country.alpha_2 if country else ''
@@ -1,6 +1,7 @@
 from functools import wraps
 from rest_framework.response import Response
 from rest_framework import status
+from .authentication import is_administrator
 
 def admin_required(view_func):
     @wraps(view_func)
@@ -8,7 +9,7 @@ def admin_required(view_func):
         user = request.user
 
         # Check if the user belongs to the 'Administrator' group
-        if user.groups.filter(name='Administrator').exists():
+        if is_administrator(user):
             # User is in the 'Administrator' group, allow access to the view
             return view_func(request, *args, **kwargs)
         else:
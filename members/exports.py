@@ -0,0 +1,170 @@
+import csv
+import os
+import json
+import hashlib
+import xlsxwriter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from .models import Member, ExportJob
+from .schema import filter_members
+from .tasks import submit_task
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_JOB_STALL_TIMEOUT = timedelta(minutes=30)
+
+MEMBER_EXPORT_FIELDS = ['name', 'surname', 'father_name', 'date_of_birth', 'email', 'mobile_number', 'qualification', 'profession', 'whatsapp_number', 'is_executive', 'is_office_bearer', 'member_type']
+ADDRESS_EXPORT_FIELDS = ['permanent_country', 'permanent_state', 'permanent_city', 'permanent_address', 'permanent_halqa', 'current_country', 'current_state', 'current_city', 'current_address', 'current_halqa']
+EXPORT_HEADERS = MEMBER_EXPORT_FIELDS + ADDRESS_EXPORT_FIELDS
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_CONTENT_TYPE = 'text/csv'
+
+def get_export_queryset(members):
+    return members.select_related('address')
+
+def get_member_export_row(member):
+    row = []
+    for field in MEMBER_EXPORT_FIELDS:
+        value = getattr(member, field)
+        if field == 'date_of_birth':
+            value = value.strftime('%Y-%m-%d') if value else ''
+        row.append('' if value is None else str(value))
+    address = member.address
+    for field in ADDRESS_EXPORT_FIELDS:
+        value = getattr(address, field) if address else None
+        row.append('' if value is None else str(value))
+    return row
+
+def iter_member_export_rows(members):
+    # iterator() streams the rows from the database cursor in chunks instead of
+    # caching the whole result set on the queryset
+    for member in get_export_queryset(members).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield get_member_export_row(member)
+
+class Echo:
+    """File-like object that hands back what is written, for csv.writer."""
+    def write(self, value):
+        return value
+
+def stream_members_csv(members):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_HEADERS)
+    for row in iter_member_export_rows(members):
+        yield writer.writerow(row)
+
+def write_csv_rows(rows, output):
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_HEADERS)
+    writer.writerows(rows)
+    return output
+
+def write_xlsx_rows(rows, output):
+    # constant_memory flushes every row to disk as soon as the next one starts,
+    # so memory stays flat however many members are exported
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet()
+    worksheet.write_row(0, 0, EXPORT_HEADERS)
+    for row_num, row in enumerate(rows, start=1):
+        worksheet.write_row(row_num, 0, row)
+    workbook.close()
+    return output
+
+def write_members_xlsx(members, output):
+    return write_xlsx_rows(iter_member_export_rows(members), output)
+
+def get_export_members(filters):
+    return filter_members(Member.objects.filter(soft_delete=False).order_by('-created_at'), filters)
+
+def get_export_fingerprint(file_format, filters):
+    state = get_export_members(filters).aggregate(count=Count('id'), last_updated=Max('updated_at'))
+    payload = json.dumps({
+        'file_format': file_format,
+        'filters': filters,
+        'count': state['count'],
+        'last_updated': state['last_updated'].isoformat() if state['last_updated'] else None,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def get_export_path(file_name):
+    return os.path.join(settings.EXPORT_ROOT, file_name)
+
+def get_reusable_export_job(fingerprint):
+    # A finished artifact is reused while its file is still around, a queued or
+    # running job is joined instead of starting a second one unless it stalled
+    job = ExportJob.objects.filter(fingerprint=fingerprint).exclude(status=ExportJob.FAILED).order_by('-created_at').first()
+    if job is None:
+        return None
+    if job.status == ExportJob.COMPLETED:
+        return job if os.path.exists(get_export_path(job.file_name)) else None
+    return job if job.updated_at >= timezone.now() - EXPORT_JOB_STALL_TIMEOUT else None
+
+def track_export_progress(job, rows):
+    processed_rows = 0
+    for row in rows:
+        yield row
+        processed_rows += 1
+        if processed_rows % EXPORT_CHUNK_SIZE == 0:
+            ExportJob.objects.filter(pk=job.pk).update(processed_rows=processed_rows, updated_at=timezone.now())
+
+def run_export_job(job_id):
+    job = ExportJob.objects.get(pk=job_id)
+    members = get_export_members(job.filters)
+    file_name = f"{job.id}.{job.file_format}"
+    path = get_export_path(file_name)
+    partial_path = f"{path}.part"
+    try:
+        total_rows = members.count()
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.RUNNING, total_rows=total_rows, updated_at=timezone.now())
+        os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+        rows = track_export_progress(job, iter_member_export_rows(members))
+        if job.file_format == ExportJob.CSV:
+            with open(partial_path, 'w', newline='', encoding='utf-8') as output:
+                write_csv_rows(rows, output)
+        else:
+            with open(partial_path, 'wb') as output:
+                write_xlsx_rows(rows, output)
+        # only ever expose complete files under the final name
+        os.replace(partial_path, path)
+    except Exception as e:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.FAILED, error=str(e), updated_at=timezone.now())
+        return
+    now = timezone.now()
+    ExportJob.objects.filter(pk=job.pk).update(
+        status=ExportJob.COMPLETED, file_name=file_name, processed_rows=total_rows, completed_at=now, updated_at=now
+    )
+
+def purge_export_jobs(cutoff):
+    """
+    Deletes the export jobs untouched since `cutoff` with their files, and any
+    other file in EXPORT_ROOT that old. Returns the numbers of jobs and files deleted.
+    """
+    # a running job touches updated_at as it goes, so only stalled or finished jobs are this old
+    jobs = ExportJob.objects.filter(updated_at__lt=cutoff)
+    file_names = [file_name for file_name in jobs.values_list('file_name', flat=True) if file_name]
+    deleted_jobs, _ = jobs.delete()
+    if not os.path.isdir(settings.EXPORT_ROOT):
+        return deleted_jobs, 0
+    deleted_files = 0
+    with os.scandir(settings.EXPORT_ROOT) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            # partial files of crashed workers and artifacts whose job row is already gone
+            if entry.name in file_names or entry.stat().st_mtime < cutoff.timestamp():
+                os.remove(entry.path)
+                deleted_files += 1
+    return deleted_jobs, deleted_files
+
+def create_export_job(file_format, filters, user):
+    fingerprint = get_export_fingerprint(file_format, filters)
+    job = get_reusable_export_job(fingerprint)
+    if job is not None:
+        return job, False
+    job = ExportJob.objects.create(file_format=file_format, filters=filters, fingerprint=fingerprint, created_by=user)
+    transaction.on_commit(lambda: submit_task(run_export_job, job.id))
+    return job, True
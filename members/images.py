@@ -0,0 +1,85 @@
+import io
+import hashlib
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .storage import get_storage
+
+# Longest side in pixels of each derivative, all re-encoded as JPEG
+IMAGE_DERIVATIVES = {
+    'thumbnail': 64,
+    'small': 256,
+    'medium': 640,
+}
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png'}
+MAX_IMAGE_PIXELS = 40_000_000
+
+class InvalidImage(ValueError):
+    pass
+
+def open_image(content):
+    """
+    Opens `content` as an image after checking that it really is a JPEG or PNG,
+    whatever the file name says, and not a decompression bomb.
+    """
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.verify()
+        # verify() leaves the image unusable, open it again to decode it
+        image = Image.open(io.BytesIO(content))
+    except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError):
+        raise InvalidImage('File is not a valid image')
+    if image.format not in IMAGE_FORMATS:
+        raise InvalidImage('Only JPEG and PNG images are supported')
+    if image.width * image.height > MAX_IMAGE_PIXELS:
+        raise InvalidImage('Image is too large')
+    return image
+
+def get_image_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+def get_original_name(image_hash, extension):
+    return f'members/{image_hash}/original.{extension}'
+
+def get_derivative_name(image_hash, derivative):
+    return f'members/{image_hash}/{derivative}.jpg'
+
+def get_image_urls(image_hash):
+    storage = get_storage()
+    return {derivative: storage.url(get_derivative_name(image_hash, derivative)) for derivative in IMAGE_DERIVATIVES}
+
+def render_derivative(image, size):
+    derivative = image.copy()
+    derivative.thumbnail((size, size), Image.LANCZOS)
+    output = io.BytesIO()
+    derivative.save(output, 'JPEG', quality=82, optimize=True, progressive=True)
+    output.seek(0)
+    return output
+
+def store_member_image(content):
+    """
+    Stores the original photo and its derivatives under the hash of its content
+    and returns (hash, original name). An image stored before is not processed
+    or uploaded again.
+    """
+    image = open_image(content)
+    storage = get_storage()
+    image_hash = get_image_hash(content)
+    image_format = image.format
+    original_name = get_original_name(image_hash, IMAGE_FORMATS[image_format])
+    # the original goes last, so its presence means every derivative is there
+    if storage.exists(original_name):
+        return image_hash, original_name
+
+    # orient by the EXIF tag before dropping the metadata, flatten transparency onto white
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    else:
+        image = image.convert('RGB')
+
+    for derivative, size in IMAGE_DERIVATIVES.items():
+        storage.save(get_derivative_name(image_hash, derivative), render_derivative(image, size), 'image/jpeg')
+    storage.save(original_name, io.BytesIO(content), Image.MIME[image_format])
+    return image_hash, original_name
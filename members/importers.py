@@ -0,0 +1,168 @@
+import csv
+import io
+from datetime import date, datetime
+from django.db import transaction
+from rest_framework import serializers
+from .models import Member, Address, MembershipFee, MembershipNumberSequence
+from .exports import MEMBER_EXPORT_FIELDS, ADDRESS_EXPORT_FIELDS
+from .schema import get_initial_membership_fees, touch_sync_rows
+from .search import build_search_document
+from .cache import invalidate_members_cache
+
+IMPORT_CHUNK_SIZE = 1000
+MEMBER_IMPORT_FIELDS = MEMBER_EXPORT_FIELDS + ['place_of_birth', 'joining_date']
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+class AddressImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Address
+        fields = ADDRESS_EXPORT_FIELDS
+
+class MemberImportSerializer(serializers.ModelSerializer):
+    # Validates a spreadsheet row without touching the database, uniqueness is
+    # checked by MemberImporter against numbers loaded once up front
+    address = AddressImportSerializer()
+
+    class Meta:
+        model = Member
+        fields = MEMBER_IMPORT_FIELDS + ['address']
+
+def clean_cell(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    # spreadsheets hand back phone numbers as numbers
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+def iter_csv_rows(file):
+    reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    yield from reader
+
+def iter_xlsx_rows(file):
+    from openpyxl import load_workbook
+
+    # read_only streams the sheet instead of loading every cell into memory
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def iter_import_rows(file, file_format):
+    """Yields (line number, row dict) for every non-empty row after the header."""
+    rows = iter_csv_rows(file) if file_format == 'csv' else iter_xlsx_rows(file)
+    headers = [clean_cell(header) for header in next(rows, [])]
+    for line, values in enumerate(rows, start=2):
+        row = {header: clean_cell(value) for header, value in zip(headers, values) if header}
+        if any(value is not None for value in row.values()):
+            yield line, row
+
+def get_row_data(row):
+    data = {field: row[field] for field in MEMBER_IMPORT_FIELDS if row.get(field) is not None}
+    data['address'] = {field: row[field] for field in ADDRESS_EXPORT_FIELDS if row.get(field) is not None}
+    return data
+
+class MemberImporter:
+    """
+    Imports members from a CSV or XLSX file in chunks. Every row is validated
+    on its own, valid rows are written with one bulk insert per table and chunk
+    and invalid rows are reported back with their line number. Each chunk
+    commits on its own, so a failure part way keeps the chunks before it.
+    """
+    def __init__(self, user, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.total_rows = 0
+        self.created = 0
+        self.errors = []
+        # one serializer validates every row, its fields are only built once
+        self.serializer = MemberImportSerializer()
+
+    def load_existing(self):
+        self.mobile_numbers, self.emails = set(), set()
+        for mobile_number, email in Member.objects.filter(soft_delete=False).values_list('mobile_number', 'email'):
+            if mobile_number:
+                self.mobile_numbers.add(mobile_number)
+            if email:
+                self.emails.add(email.lower())
+
+    def run(self, file, file_format):
+        self.load_existing()
+        chunk = []
+        for line, row in iter_import_rows(file, file_format):
+            self.total_rows += 1
+            chunk.append((line, row))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.get_report()
+
+    def get_report(self):
+        return {'total_rows': self.total_rows, 'created': self.created, 'dry_run': self.dry_run, 'errors': self.errors}
+
+    def check_unique(self, data):
+        errors = {}
+        mobile_number, email = data.get('mobile_number'), (data.get('email') or '').lower()
+        if mobile_number and mobile_number in self.mobile_numbers:
+            errors['mobile_number'] = ["Member with this mobile number already exists."]
+        if email and email in self.emails:
+            errors['email'] = ["Member with this email already exists."]
+        return errors
+
+    def validate_row(self, data):
+        try:
+            data = self.serializer.run_validation(data)
+        except serializers.ValidationError as e:
+            return None, e.detail
+        return data, self.check_unique(data)
+
+    def import_chunk(self, chunk):
+        valid = []
+        for line, row in chunk:
+            data, errors = self.validate_row(get_row_data(row))
+            if errors:
+                self.errors.append({'row': line, 'errors': errors})
+                continue
+            # later rows of the same file count as duplicates too
+            if data.get('mobile_number'):
+                self.mobile_numbers.add(data['mobile_number'])
+            if data.get('email'):
+                self.emails.add(data['email'].lower())
+            valid.append(data)
+        if valid and not self.dry_run:
+            self.create_members(valid)
+        self.created += len(valid)
+
+    def create_members(self, rows):
+        # bulk_create skips the pre_save signals, so numbers, search documents and country codes are set here.
+        # The block is reserved in its own transaction, add_member does not wait on the counter for the inserts
+        numbers = MembershipNumberSequence.objects.reserve(len(rows))
+        addresses, members = [], []
+        for data, membership_number in zip(rows, numbers):
+            address = Address(**data.pop('address'))
+            address.refresh_country_codes()
+            member = Member(address=address, created_by=self.user, membership_number=membership_number, **data)
+            member.search_document = build_search_document(member)
+            addresses.append(address)
+            members.append(member)
+        with transaction.atomic():
+            Address.objects.bulk_create(addresses)
+            Member.objects.bulk_create(members)
+            MembershipFee.objects.bulk_create(
+                [fee for member in members for fee in get_initial_membership_fees(member, self.user)],
+                batch_size=self.chunk_size,
+            )
+            # the first rows were stamped when the chunk started, not when it commits
+            member_ids = [member.pk for member in members]
+            touch_sync_rows(Member, 'pk', member_ids)
+            touch_sync_rows(MembershipFee, 'member_id', member_ids)
+            invalidate_members_cache()
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from members.models import User
+from members.importers import MemberImporter, IMPORT_FORMATS, IMPORT_CHUNK_SIZE
+
+class Command(BaseCommand):
+    help = "Imports members from a CSV or XLSX file with the member export columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file to import')
+        parser.add_argument('--user', required=True, help='Email of the user recorded as creator of the members')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows written per bulk insert')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without creating members')
+
+    def handle(self, *args, **options):
+        file_format = options['path'].rsplit('.', 1)[-1].lower()
+        if file_format not in IMPORT_FORMATS:
+            raise CommandError("Only CSV and XLSX files can be imported")
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        started = time.monotonic()
+        importer = MemberImporter(user, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        with open(options['path'], 'rb') as file:
+            report = importer.run(file, file_format)
+        elapsed = time.monotonic() - started
+
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f"Row {error['row']}: {dict(error['errors'])}"))
+        action = 'Validated' if report['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {report['created']} of {report['total_rows']} rows in {elapsed:.2f}s, {len(report['errors'])} rows rejected"
+        ))
@@ -0,0 +1,56 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from members.models import Member
+from members.managers import current_suspension_end
+from members.cache import invalidate_members_cache, invalidate_member_documents
+
+class Command(BaseCommand):
+    help = "Clears the suspension state of members whose suspension has ended, in batches. Safe to run repeatedly."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Members updated per transaction')
+        parser.add_argument('--resync', action='store_true', help='Also recompute suspended_until for members that drifted from their suspensions')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        expired = self.process(
+            lambda now: Member.objects.expired_suspensions(now),
+            lambda pks, now: Member.objects.expired_suspensions(now).filter(pk__in=pks).update(suspended_until=None, updated_at=now),
+            batch_size,
+        )
+        resynced = 0
+        if options['resync']:
+            resynced = self.process(
+                lambda now: Member.objects.suspension_drift(now),
+                lambda pks, now: Member.objects.filter(pk__in=pks).update(suspended_until=current_suspension_end(now), updated_at=now),
+                batch_size,
+            )
+
+        if expired or resynced:
+            invalidate_members_cache()
+        elapsed = time.monotonic() - started
+        rate = (expired + resynced) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {expired} and resynced {resynced} suspensions in {elapsed:.2f}s ({rate:.0f} members/s)"
+        ))
+
+    def process(self, get_members, update, batch_size):
+        processed = 0
+        while True:
+            now = timezone.now()
+            with transaction.atomic():
+                # skip_locked lets overlapping runs share the work instead of waiting on each other
+                pks = list(
+                    get_members(now).select_for_update(skip_locked=True, of=('self',)).order_by('pk').values_list('pk', flat=True)[:batch_size]
+                )
+                if not pks:
+                    return processed
+                updated = update(pks, now)
+                invalidate_member_documents(pks)
+            processed += updated
+            if not updated or len(pks) < batch_size:
+                return processed
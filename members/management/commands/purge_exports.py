@@ -0,0 +1,16 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from members.exports import purge_export_jobs
+
+class Command(BaseCommand):
+    help = "Deletes export jobs and their files older than EXPORT_RETENTION_DAYS. Safe to run repeatedly."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.EXPORT_RETENTION_DAYS, help='Keep exports touched in the last this many days')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        jobs, files = purge_export_jobs(cutoff)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {jobs} export jobs and {files} export files"))
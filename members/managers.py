@@ -1,5 +1,10 @@
 from django.contrib.auth.models import BaseUserManager
 from django.contrib.auth.models import Group
+from django.db import models, transaction
+from django.db.models import F, Q, Case, When, Value, OuterRef, Prefetch, Subquery
+import re
+from django.utils import timezone
+from .cache import invalidate_members_cache, invalidate_member_documents
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -23,4 +28,127 @@ class CustomUserManager(BaseUserManager):
         if extra_fields.get("is_superuser") is not True:
             raise ValueError("Superuser must have is_superuser=True.")
 
-        return self.create_user(email, password, **extra_fields)
\ No newline at end of file
+        return self.create_user(email, password, **extra_fields)
+
+# Columns read by the serializer fields that are not columns themselves
+MEMBER_FIELD_COLUMNS = {
+    'is_suspended': ('suspended_until',),
+    'current_suspension_history': ('suspended_until',),
+    'image_urls': ('image_hash',),
+}
+MEMBER_RELATIONS = ('address', 'created_by', 'approved_by')
+
+class MemberQuerySet(models.QuerySet):
+    def with_current_suspensions(self):
+        # Loads the active suspensions of every member in a single query, the
+        # serializer reads them back from `current_suspensions`.
+        from .models import Suspension
+        current_suspensions = Suspension.objects.filter(end_date__gte=timezone.now()).select_related('created_by')
+        return self.prefetch_related(
+            Prefetch('suspensions', queryset=current_suspensions, to_attr='current_suspensions')
+        )
+
+    def for_listing(self):
+        return self.select_related(*MEMBER_RELATIONS).with_current_suspensions()
+
+    def for_fields(self, fields, expand):
+        """
+        for_listing() cut down to a sparse fieldset: only the columns behind
+        `fields` are loaded, only the `expand`ed relations are joined and
+        current suspensions are only prefetched when they are rendered.
+        """
+        # created_at and id are what the listings order and paginate on
+        columns = {'id', 'created_at'}
+        for name in fields:
+            columns.update(MEMBER_FIELD_COLUMNS.get(name, (name,)))
+        queryset = self.only(*columns)
+        relations = [name for name in MEMBER_RELATIONS if name in expand]
+        # select_related() with no arguments would join every relation
+        if relations:
+            queryset = queryset.select_related(*relations)
+        if 'current_suspension_history' in fields:
+            queryset = queryset.with_current_suspensions()
+        return queryset
+
+    def bulk_suspend(self, end_date, reason, user):
+        """
+        Suspends every member in the queryset until `end_date` with a single
+        batched insert, and extends `suspended_until` where it ends earlier.
+        Returns {member_id: suspended_until}.
+        """
+        from .models import Suspension
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            member_ids = list(self.select_for_update(of=('self',)).order_by('pk').values_list('pk', flat=True))
+            Suspension.objects.bulk_create([
+                Suspension(member_id=member_id, start_date=now, end_date=end_date, reason=reason, created_by=user, updated_by=user)
+                for member_id in member_ids
+            ], batch_size=1000)
+            members = self.model.objects.filter(pk__in=member_ids)
+            # every member gained a suspension, suspended_until only moves when it ends earlier
+            if end_date >= now:
+                extends = Q(suspended_until__isnull=True) | Q(suspended_until__lt=end_date)
+                members.update(suspended_until=Case(When(extends, then=Value(end_date)), default=F('suspended_until')), updated_at=now)
+            else:
+                members.update(updated_at=now)
+            invalidate_members_cache()
+            invalidate_member_documents(member_ids)
+            return dict(members.values_list('pk', 'suspended_until'))
+
+    def bulk_lift_suspension(self):
+        """
+        Ends the active suspensions of every member in the queryset with one
+        update per table. Returns {member_id: whether a suspension was lifted}.
+        """
+        from .models import Suspension
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            member_ids = list(self.select_for_update(of=('self',)).order_by('pk').values_list('pk', flat=True))
+            active = Suspension.objects.filter(member_id__in=member_ids, end_date__gte=now)
+            lifted = set(active.values_list('member_id', flat=True))
+            lifted.update(self.model.objects.filter(pk__in=member_ids, suspended_until__gte=now).values_list('pk', flat=True))
+            active.update(end_date=now, updated_at=now)
+            self.model.objects.filter(pk__in=lifted).update(suspended_until=None, updated_at=now)
+            invalidate_members_cache()
+            invalidate_member_documents(lifted)
+        return {member_id: member_id in lifted for member_id in member_ids}
+
+    def expired_suspensions(self, now):
+        return self.filter(suspended_until__lt=now)
+
+    def suspension_drift(self, now):
+        # Members whose `suspended_until` disagrees with their active suspension rows,
+        # e.g. after suspensions were edited or deleted outside suspend()/lift_suspension()
+        return self.annotate(current_suspension_end=current_suspension_end(now)).filter(
+            Q(current_suspension_end__isnull=False, suspended_until__isnull=True)
+            | Q(current_suspension_end__isnull=True, suspended_until__gte=now)
+            | (Q(current_suspension_end__isnull=False) & ~Q(suspended_until=F('current_suspension_end')))
+        )
+
+def current_suspension_end(now):
+    from .models import Suspension
+    return Subquery(
+        Suspension.objects.filter(member=OuterRef('pk'), end_date__gte=now).order_by('-end_date').values('end_date')[:1]
+    )
+
+class MembershipNumberSequenceManager(models.Manager):
+    def reserve(self, count=1, prefix='MIT'):
+        """
+        Hands out `count` consecutive membership numbers. The counter row is
+        incremented in place, so concurrent callers queue on its row lock and
+        never see the same value.
+        """
+        with transaction.atomic(using=self.db):
+            if not self.filter(name=prefix).update(last_value=F('last_value') + count):
+                self.seed(prefix)
+                self.filter(name=prefix).update(last_value=F('last_value') + count)
+            last_value = self.filter(name=prefix).values_list('last_value', flat=True).get()
+        return [f'{prefix}-{value:05}' for value in range(last_value - count + 1, last_value + 1)]
+
+    def seed(self, prefix='MIT'):
+        # Only needed when the counter row is missing, start after the highest number in use
+        from .models import Member
+        pattern = re.compile(rf'^{re.escape(prefix)}-(\d+)$')
+        numbers = Member.objects.filter(membership_number__startswith=f'{prefix}-').values_list('membership_number', flat=True)
+        last_value = max((int(match.group(1)) for match in map(pattern.match, numbers) if match), default=0)
+        self.get_or_create(name=prefix, defaults={'last_value': last_value})
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+from members.search import build_search_document
+
+
+def populate_search_documents(apps, schema_editor):
+    Member = apps.get_model("members", "Member")
+    members = list(Member.objects.only("name", "surname", "father_name"))
+    for member in members:
+        member.search_document = build_search_document(member)
+    Member.objects.bulk_update(members, ["search_document"], batch_size=1000)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS members_member_search_trgm "
+        "ON members_member USING gin (search_document gin_trgm_ops)"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS members_member_search_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0002_user_created_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="member",
+            name="search_document",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+# member-list filters with icontains, which PostgreSQL renders as
+# UPPER(column::text) LIKE UPPER(...); trigram indexes on that expression serve it.
+TRIGRAM_INDEXES = [
+    ("address_current_country_trgm", "members_address", "current_country", ""),
+    ("address_current_state_trgm", "members_address", "current_state", ""),
+    ("address_current_city_trgm", "members_address", "current_city", ""),
+    ("address_current_halqa_trgm", "members_address", "current_halqa", ""),
+    (
+        "member_active_mobile_trgm",
+        "members_member",
+        "mobile_number",
+        "WHERE NOT soft_delete",
+    ),
+    (
+        "member_active_number_trgm",
+        "members_member",
+        "membership_number",
+        "WHERE NOT soft_delete",
+    ),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column, condition in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+            f"USING gin (UPPER({column}::text) gin_trgm_ops) {condition}"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table, column, condition in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0003_member_search_document"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="member",
+            index=models.Index(
+                condition=models.Q(("soft_delete", False)),
+                fields=["-created_at", "-id"],
+                name="member_active_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="member",
+            index=models.Index(
+                condition=models.Q(("soft_delete", False)),
+                fields=["status", "-created_at"],
+                name="member_active_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="member",
+            index=models.Index(
+                condition=models.Q(("soft_delete", False)),
+                fields=["mobile_number"],
+                name="member_active_mobile_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="member",
+            index=models.Index(
+                condition=models.Q(("soft_delete", False)),
+                fields=["email"],
+                name="member_active_email_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="membershipfee",
+            index=models.Index(fields=["member", "year"], name="fee_member_year_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="membershipfee",
+            index=models.Index(fields=["-created_at", "-id"], name="fee_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="membershipfee",
+            index=models.Index(
+                fields=["year", "-created_at", "-id"], name="fee_year_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="suspension",
+            index=models.Index(
+                fields=["member", "end_date"], name="suspension_member_end_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="suspension",
+            index=models.Index(fields=["end_date"], name="suspension_end_idx"),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
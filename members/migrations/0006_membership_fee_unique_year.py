@@ -0,0 +1,62 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:34
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_years(apps, schema_editor):
+    # Keep one row per (member, year): a paid row over a due one, then the most recently updated.
+    # Rows that disagree on what was paid are left for an admin to resolve.
+    MembershipFee = apps.get_model("members", "MembershipFee")
+    duplicates = list(
+        MembershipFee.objects.values("member_id", "year")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+    )
+    conflicts = []
+    for duplicate in duplicates:
+        fees = MembershipFee.objects.filter(
+            member_id=duplicate["member_id"], year=duplicate["year"]
+        )
+        if len(set(fees.values_list("amount", "reference_number", "fee_status"))) > 1:
+            conflicts.append(
+                f"member {duplicate['member_id']}, year {duplicate['year']}: "
+                + ", ".join(str(pk) for pk in fees.values_list("id", flat=True))
+            )
+    if conflicts:
+        raise RuntimeError(
+            "These membership fees have several rows for one year that differ in amount, "
+            "reference_number or fee_status. Delete all but the correct row of each and "
+            "migrate again:\n" + "\n".join(conflicts)
+        )
+    for duplicate in duplicates:
+        fees = MembershipFee.objects.filter(
+            member_id=duplicate["member_id"], year=duplicate["year"]
+        )
+        keep = sorted(
+            fees,
+            key=lambda fee: (fee.fee_status == "paid", fee.updated_at),
+            reverse=True,
+        )[0]
+        fees.exclude(pk=keep.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0005_exportjob"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_years, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="membershipfee",
+            name="fee_member_year_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="membershipfee",
+            constraint=models.UniqueConstraint(
+                fields=("member", "year"), name="unique_membership_fee_year"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:36
+
+import re
+from django.db import migrations, models
+
+
+def seed_membership_numbers(apps, schema_editor):
+    # Continue numbering after the highest MIT-<n> already handed out
+    Member = apps.get_model("members", "Member")
+    MembershipNumberSequence = apps.get_model("members", "MembershipNumberSequence")
+    numbers = Member.objects.filter(membership_number__startswith="MIT-").values_list(
+        "membership_number", flat=True
+    )
+    matches = (re.match(r"^MIT-(\d+)$", number) for number in numbers)
+    last_value = max((int(match.group(1)) for match in matches if match), default=0)
+    MembershipNumberSequence.objects.create(name="MIT", last_value=last_value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0006_membership_fee_unique_year"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MembershipNumberSequence",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=10, primary_key=True, serialize=False),
+                ),
+                ("last_value", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_membership_numbers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:44
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+
+
+def populate_suspended_until(apps, schema_editor):
+    Member = apps.get_model("members", "Member")
+    Suspension = apps.get_model("members", "Suspension")
+    current_end = (
+        Suspension.objects.filter(member=OuterRef("pk"), end_date__gte=timezone.now())
+        .values("member")
+        .annotate(end=Max("end_date"))
+        .values("end")
+    )
+    Member.objects.filter(suspensions__end_date__gte=timezone.now()).update(
+        suspended_until=Subquery(current_end)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0007_membershipnumbersequence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="member",
+            name="suspended_until",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="member",
+            index=models.Index(
+                condition=models.Q(("suspended_until__isnull", False)),
+                fields=["suspended_until"],
+                name="member_suspended_until_idx",
+            ),
+        ),
+        migrations.RunPython(populate_suspended_until, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0008_member_suspended_until"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="member",
+            name="image_hash",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+    ]
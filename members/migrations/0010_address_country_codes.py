@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+from members.countries import get_country_code
+
+
+def populate_country_codes(apps, schema_editor):
+    # One UPDATE per distinct country name rather than one per address
+    Address = apps.get_model("members", "Address")
+    for field in ("permanent_country", "current_country"):
+        names = Address.objects.values_list(field, flat=True).distinct()
+        for name in list(names):
+            Address.objects.filter(**{field: name}).update(
+                **{f"{field}_code": get_country_code(name)}
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0009_member_image_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="current_country_code",
+            field=models.CharField(blank=True, editable=False, max_length=2, null=True),
+        ),
+        migrations.AddField(
+            model_name="address",
+            name="permanent_country_code",
+            field=models.CharField(blank=True, editable=False, max_length=2, null=True),
+        ),
+        migrations.RunPython(populate_country_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0010_address_country_codes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="membershipfee",
+            index=models.Index(
+                fields=["fee_status", "-created_at", "-id"],
+                name="fee_status_created_idx",
+            ),
+        ),
+    ]
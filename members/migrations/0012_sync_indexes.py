@@ -0,0 +1,27 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("members", "0011_membership_fee_status_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="member",
+            index=models.Index(fields=["updated_at", "id"], name="member_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="membershipfee",
+            index=models.Index(fields=["updated_at", "id"], name="fee_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="suspension",
+            index=models.Index(
+                fields=["updated_at", "id"], name="suspension_updated_idx"
+            ),
+        ),
+    ]
@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import (
     AbstractBaseUser,
     PermissionsMixin,
 )
-from .managers import CustomUserManager
+from .managers import CustomUserManager, MemberQuerySet, MembershipNumberSequenceManager
+from .countries import get_country_code
+from .cache import invalidate_members_cache, invalidate_member_documents
 import uuid
 from django.conf import settings
 from django.utils import timezone
@@ -17,6 +20,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     mobile_number = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
     
     objects = CustomUserManager()
 
@@ -37,10 +41,26 @@ class Address(models.Model):
     current_city = models.CharField(max_length=40)
     current_address = models.CharField(max_length=70)
     current_halqa = models.CharField(max_length=40, null=True, blank=True)
+    # Resolved when the address is saved, '' when the country is not recognised
+    permanent_country_code = models.CharField(max_length=2, null=True, blank=True, editable=False)
+    current_country_code = models.CharField(max_length=2, null=True, blank=True, editable=False)
 
     def __str__(self) -> str:
         return self.id
 
+    def refresh_country_codes(self):
+        self.permanent_country_code = get_country_code(self.permanent_country)
+        self.current_country_code = get_country_code(self.current_country)
+
+def normalize_suspension_end_date(value):
+    # Accepts the date or datetime strings the API receives, naive values are taken in the current time zone
+    end_date = models.DateTimeField().to_python(value)
+    if end_date is None:
+        raise ValidationError('Suspension end date is required.')
+    if timezone.is_naive(end_date):
+        end_date = timezone.make_aware(end_date)
+    return end_date
+
 class Member(models.Model):
 
     PENDING = 'pending'
@@ -68,6 +88,8 @@ class Member(models.Model):
     date_of_birth = models.DateField(null=True, blank=True)
     place_of_birth = models.CharField(max_length=100, null=True, blank=True)
     image_url = models.URLField(max_length=200, null=True, blank=True)
+    # sha256 of the photo, its resized copies are stored under it
+    image_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
     email = models.EmailField(null=True, blank=True)
     mobile_number = models.CharField(max_length=15, null=True, blank=True)
     qualification = models.CharField(max_length=30, null=True, blank=True)
@@ -83,10 +105,27 @@ class Member(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     approved_at = models.DateTimeField(null=True, blank=True)
+    search_document = models.TextField(default='', blank=True, editable=False)
+    # End of the latest active suspension, kept in sync by suspend() and lift_suspension()
+    suspended_until = models.DateTimeField(null=True, blank=True, editable=False)
 
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='members_created')
     approved_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='members_approved')
 
+    objects = MemberQuerySet.as_manager()
+
+    class Meta:
+        # Every listing reads only live members, so the hot indexes are partial on soft_delete=False
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(soft_delete=False), name='member_active_created_idx'),
+            models.Index(fields=['status', '-created_at'], condition=models.Q(soft_delete=False), name='member_active_status_idx'),
+            models.Index(fields=['mobile_number'], condition=models.Q(soft_delete=False), name='member_active_mobile_idx'),
+            models.Index(fields=['email'], condition=models.Q(soft_delete=False), name='member_active_email_idx'),
+            models.Index(fields=['suspended_until'], condition=models.Q(suspended_until__isnull=False), name='member_suspended_until_idx'),
+            # The change feed, which includes soft-deleted members
+            models.Index(fields=['updated_at', 'id'], name='member_updated_idx'),
+        ]
+
     def __str__(self) -> str:
         return self.name + " " + self.surname
     
@@ -96,18 +135,52 @@ class Member(models.Model):
     
     # @property
     def is_currently_suspended(self):
-        current_suspensions = self.suspensions.filter(end_date__gte=timezone.now())
-        return current_suspensions.exists()
+        return self.suspended_until is not None and self.suspended_until >= timezone.now()
+
+    def get_current_suspensions(self):
+        # Prefer the suspensions loaded by `Member.objects.for_listing()`
+        if not hasattr(self, 'current_suspensions'):
+            if self.is_currently_suspended():
+                self.current_suspensions = list(self.suspensions.filter(end_date__gte=timezone.now()).select_related('created_by'))
+            else:
+                self.current_suspensions = []
+        return self.current_suspensions
     
     def suspend(self, end_date, reason, user):
-        Suspension.objects.create(member=self, start_date=timezone.now(), end_date=end_date, reason=reason, created_by=user, updated_by=user)
-        self.save()
+        end_date = normalize_suspension_end_date(end_date)
+        now = timezone.now()
+        extended = 0
+        with transaction.atomic():
+            Suspension.objects.create(member=self, start_date=now, end_date=end_date, reason=reason, created_by=user, updated_by=user)
+            # Only ever extends the suspension, an earlier end date leaves the longer one in place
+            if end_date >= now:
+                extended = Member.objects.filter(pk=self.pk).filter(
+                    models.Q(suspended_until__isnull=True) | models.Q(suspended_until__lt=end_date)
+                ).update(suspended_until=end_date, updated_at=now)
+        if extended:
+            self.suspended_until = end_date
+            self.updated_at = now
+        self.__dict__.pop('current_suspensions', None)
 
     def lift_suspension(self):
-        current_suspensions = self.suspensions.filter(end_date__gte=timezone.now())
-        for suspension in current_suspensions:
-            suspension.end_date = timezone.now()
-            suspension.save()
+        now = timezone.now()
+        with transaction.atomic():
+            self.suspensions.filter(end_date__gte=now).update(end_date=now, updated_at=now)
+            Member.objects.filter(pk=self.pk).update(suspended_until=None, updated_at=now)
+            invalidate_members_cache()
+            invalidate_member_documents([self.pk])
+        self.suspended_until = None
+        self.updated_at = now
+        self.__dict__.pop('current_suspensions', None)
+
+class MembershipNumberSequence(models.Model):
+    name = models.CharField(max_length=10, primary_key=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+
+    objects = MembershipNumberSequenceManager()
+
+    def __str__(self):
+        return f"{self.name}-{self.last_value:05}"
 
 class MembershipFee(models.Model):
     DUE = 'due'
@@ -127,6 +200,17 @@ class MembershipFee(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['member', 'year'], name='unique_membership_fee_year'),
+        ]
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='fee_created_idx'),
+            models.Index(fields=['year', '-created_at', '-id'], name='fee_year_created_idx'),
+            models.Index(fields=['fee_status', '-created_at', '-id'], name='fee_status_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='fee_updated_idx'),
+        ]
+
     def __str__(self) -> str:
         return self.reference_number
     
@@ -142,5 +226,49 @@ class Suspension(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['member', 'end_date'], name='suspension_member_end_idx'),
+            models.Index(fields=['end_date'], name='suspension_end_idx'),
+            models.Index(fields=['updated_at', 'id'], name='suspension_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.member.name} suspended from {self.start_date} to {self.end_date}"
+
+class ExportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CSV = 'csv'
+    XLSX = 'xlsx'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+    FILE_FORMAT_CHOICES = [
+        (CSV, 'CSV'),
+        (XLSX, 'XLSX'),
+    ]
+
+    id = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
+    file_format = models.CharField(max_length=10, choices=FILE_FORMAT_CHOICES, default=XLSX)
+    filters = models.JSONField(default=dict, blank=True)
+    # Hash of the format, the filters and the state of the matching members,
+    # identical exports share it for as long as those members don't change
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    file_name = models.CharField(max_length=255, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='export_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
-        return f"{self.member.name} suspended from {self.start_date} to {self.end_date}"
\ No newline at end of file
+        return f"{self.file_format} export {self.id} ({self.status})"
@@ -1,14 +1,220 @@
-import boto3
-import os
 import uuid
+import json
+import base64
+import logging
+from datetime import datetime, date
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.db.models import Q, Count, Min, Max, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.text import get_valid_filename
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from .search import search_members
+from .models import Member, MembershipFee, Suspension
+from .tasks import submit_task
+from .storage import get_storage
+from .images import store_member_image, InvalidImage
+from .cache import invalidate_members_cache, invalidate_member_documents, get_member_document, get_versioned
+
+logger = logging.getLogger(__name__)
 
 class MembersModulePagination(PageNumberPagination):
     page_size = 12
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+def decode_cursor(encoded):
+    try:
+        return json.loads(base64.urlsafe_b64decode(encoded.encode()))
+    except (TypeError, ValueError):
+        raise NotFound('Invalid cursor')
+
+def get_keyset_position(row, ordering):
+    position = []
+    for field in ordering:
+        name = field.lstrip('-')
+        value = row[name] if isinstance(row, dict) else getattr(row, name)
+        position.append(value.isoformat() if isinstance(value, datetime) else str(value))
+    return position
+
+def get_ordering_field(queryset, name):
+    # Aggregates and other annotations carry their own output field
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+def parse_keyset_position(queryset, ordering, position):
+    """
+    Converts the values of a decoded cursor to the types of their ordering
+    fields, raising NotFound for values no cursor of ours could hold.
+    """
+    if not isinstance(position, list) or len(position) != len(ordering):
+        raise NotFound('Invalid cursor')
+    values = []
+    for field, value in zip(ordering, position):
+        # get_keyset_position only ever writes strings
+        if not isinstance(value, str):
+            raise NotFound('Invalid cursor')
+        try:
+            values.append(get_ordering_field(queryset, field.lstrip('-')).to_python(value))
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+    return values
+
+def keyset_filter(ordering, position):
+    # Rows strictly after `position` in `ordering`, e.g. for ('-created_at', '-id'):
+    # created_at < c OR (created_at = c AND id < i)
+    condition = Q()
+    for index, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f"{field.lstrip('-')}__{lookup}": position[index]})
+        for previous, value in zip(ordering[:index], position):
+            clause &= Q(**{previous.lstrip('-'): value})
+        condition |= clause
+    return condition
+
+class MembersKeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering. Pages are fetched with a range filter
+    on the last row seen instead of an OFFSET, and no COUNT(*) is issued.
+    """
+    page_size = 12
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        position, self.reverse = None, False
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            cursor = decode_cursor(encoded)
+            if not isinstance(cursor, dict):
+                raise NotFound('Invalid cursor')
+            position = parse_keyset_position(queryset, self.ordering, cursor.get('p'))
+            self.reverse = bool(cursor.get('r'))
+
+        # Walking backwards reads the rows before the cursor in the opposite order
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_link(self, row, reverse):
+        cursor = {'p': get_keyset_position(row, self.ordering), 'r': reverse}
+        return replace_query_param(self.base_url, self.cursor_query_param, encode_cursor(cursor))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.get_link(self.page[0], True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+def get_paginator(request, ordering=None):
+    # Cursor mode is opt-in, either by asking for it or by following a cursor link
+    if request.query_params.get('pagination') == 'cursor' or request.query_params.get('cursor'):
+        return MembersKeysetPagination(ordering)
+    return MembersModulePagination()
+
+SYNC_ORDERING = ('updated_at', 'id')
+SYNC_PAGE_SIZE = 100
+SYNC_MAX_PAGE_SIZE = 500
+
+def get_sync_page_size(params):
+    try:
+        return _positive_int(params['page_size'], strict=True, cutoff=SYNC_MAX_PAGE_SIZE)
+    except (KeyError, ValueError):
+        return SYNC_PAGE_SIZE
+
+def get_sync_querysets():
+    # Soft-deleted members are kept in the feed, clients prune them from their copy
+    return {
+        'members': Member.objects.for_listing(),
+        'membership_fees': MembershipFee.objects.all(),
+        'suspensions': Suspension.objects.select_related('created_by'),
+    }
+
+def read_sync_cursor(encoded):
+    """The last (updated_at, id) synced of each stream, {} to start from the beginning."""
+    if not encoded:
+        return {}
+    cursor = decode_cursor(encoded)
+    querysets = get_sync_querysets()
+    if not isinstance(cursor, dict) or any(stream not in querysets for stream in cursor):
+        raise NotFound('Invalid cursor')
+    for stream, position in cursor.items():
+        # only checked, the positions are handed back to the client as they came
+        parse_keyset_position(querysets[stream], SYNC_ORDERING, position)
+    return cursor
+
+def touch_sync_rows(model, field, values, batch_size=1000):
+    """
+    Restamps updated_at of the `model` rows whose `field` is in `values`. Called
+    last in a long transaction, so the rows it wrote carry a stamp within
+    SYNC_SAFETY_LAG of the commit and are not left behind any cursor handed out meanwhile.
+    """
+    now = timezone.now()
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        model.objects.filter(**{f'{field}__in': values[start:start + batch_size]}).update(updated_at=now)
+
+def get_changes(queryset, position, page_size, until):
+    """
+    Up to `page_size` rows changed after `position` and no later than `until`,
+    oldest first, and whether more are waiting. Served by the (updated_at, id) indexes.
+    """
+    queryset = queryset.filter(updated_at__lte=until).order_by(*SYNC_ORDERING)
+    if position:
+        queryset = queryset.filter(keyset_filter(SYNC_ORDERING, position))
+    rows = list(queryset[:page_size + 1])
+    return rows[:page_size], len(rows) > page_size
+
 ALLOWED_EXTENSIONS = {'png','jpg', 'jpeg'}
 
 def allowed_file(filename):
@@ -22,42 +228,245 @@ def get_secure_filename(filename):
     return unique_filename
 
 
-def upload_file_to_s3(file, acl="public-read"):
-    filename = get_secure_filename(file.name)
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=os.getenv('AWS_S3_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_S3_SECRET_ACCESS_KEY')
-    )
+def get_member_image_name(filename):
+    return f"members/{get_secure_filename(filename)}"
+
+def set_member_image(member_id, content):
+    image_hash, name = store_member_image(content)
+    Member.objects.filter(pk=member_id).update(image_url=get_storage().url(name), image_hash=image_hash, updated_at=timezone.now())
+    invalidate_members_cache()
+    invalidate_member_documents([member_id])
+
+def upload_member_image(member_id, content):
     try:
-        s3.upload_fileobj(
-            file,
-            os.getenv("AWS_S3_BUCKET_NAME"),
-            f"members/{filename}",
-            ExtraArgs={
-                "ContentType": file.content_type
-            }
+        set_member_image(member_id, content)
+    except Exception:
+        logger.exception("Image upload failed for member %s", member_id)
+
+def process_uploaded_member_image(member_id, name):
+    # Direct uploads skip the API, they are checked and resized once they land in storage
+    storage = get_storage()
+    try:
+        # the upload URL may be reused after the confirmation, so the size is checked again here
+        if (storage.size(name) or 0) > settings.IMAGE_UPLOAD_MAX_SIZE:
+            raise InvalidImage(f"Upload is larger than {settings.IMAGE_UPLOAD_MAX_SIZE} bytes")
+        set_member_image(member_id, storage.read(name))
+    except InvalidImage:
+        logger.warning("Rejected uploaded image %s for member %s", name, member_id)
+        Member.objects.filter(pk=member_id, image_url=storage.url(name)).update(image_url=None, image_hash=None, updated_at=timezone.now())
+        invalidate_members_cache()
+        invalidate_member_documents([member_id])
+    except Exception:
+        logger.exception("Image processing failed for member %s", member_id)
+        return
+    # the member now points at the hashed copy, or at nothing
+    storage.delete(name)
+
+def schedule_member_image_upload(member, file):
+    """
+    Stores `file` as the member's photo once the current transaction commits,
+    on the background workers. `image_url` is filled in when the upload is done.
+    """
+    if not allowed_file(file.name):
+        raise ValueError(f"Incorrect File Type")
+    # The request's temporary upload is gone once the response is sent, keep the bytes
+    file.seek(0)
+    content = file.read()
+    transaction.on_commit(lambda: submit_task(upload_member_image, member.pk, content))
+
+MEMBER_FILTER_PARAMS = ('country', 'state', 'city', 'halqa', 'query', 'status', 'mobile_number', 'meber_id', 'suspended')
+
+def get_member_filters(params):
+    return {key: str(params[key]) for key in MEMBER_FILTER_PARAMS if params.get(key) is not None}
+
+def filter_members(members, params):
+    # The filters accepted by member-list, shared with the member exports
+    country = params.get("country", None)
+    state = params.get("state", None)
+    city = params.get("city", None)
+    halqa = params.get("halqa", None)
+    query = params.get("query", None)
+    member_status = params.get("status", None)
+    mobile_number = params.get("mobile_number", None)
+    member_id = params.get("meber_id", None)
+    suspended = params.get("suspended", None)
+
+    if country is not None:
+        members = members.filter(Q(address__current_country__icontains=country))
+
+    if state is not None:
+        members = members.filter(Q(address__current_state__icontains=state))
+
+    if city is not None:
+        members = members.filter(Q(address__current_city__icontains=city))
+
+    if halqa is not None:
+        members = members.filter(Q(address__current_halqa__icontains=halqa))
+
+    if query is not None:
+        members = search_members(members, query)
+
+    if member_status is not None:
+        members = members.filter(status = member_status)
+
+    if mobile_number is not None:
+        members = members.filter(Q(mobile_number__icontains=mobile_number.strip()))
+
+    if member_id is not None:
+        members = members.filter(Q(membership_number__icontains=member_id))
+
+    if suspended is not None:
+        currently_suspended = Q(suspended_until__gte=timezone.now())
+        if str(suspended).lower() in ('true', '1'):
+            members = members.filter(currently_suspended)
+        elif str(suspended).lower() in ('false', '0'):
+            members = members.exclude(currently_suspended)
+
+    return members
+
+def get_field_params(params):
+    """The comma separated `fields` and `expand` query parameters, None for either one not given."""
+    def split(name):
+        value = params.get(name, None)
+        if value is None:
+            return None
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return split('fields'), split('expand')
+
+def get_membership_fee_queryset(fields, expand):
+    # Joins just the relations the fee serializer expands, the others render as ids
+    relations = [name for name in ('member', 'created_by', 'updated_by') if name in expand]
+    if 'member' in relations:
+        relations.append('member__address')
+    membership_fees = MembershipFee.objects.all()
+    return membership_fees.select_related(*relations) if relations else membership_fees
+
+def get_member_list_queryset(params, fields, expand):
+    """The member-list queryset for a request's filters and resolved fieldset."""
+    members = Member.objects.for_fields(fields, expand).filter(soft_delete=False).order_by('-created_at')
+    return filter_members(members, params)
+
+def get_membership_fee_list_queryset(params, fields, expand):
+    """The view_membership_fee queryset, raises ValidationError for a malformed member_id."""
+    membership_fees = get_membership_fee_queryset(fields, expand).filter(member__soft_delete=False).order_by("-created_at")
+    return filter_membership_fees(membership_fees, params)
+
+def filter_membership_fees(membership_fees, params):
+    # Exact matches only, each one is served by an index on the fee or member table
+    year = params.get("year", None)
+    fee_status = params.get("fee_status", None)
+    member_id = params.get("member_id", None)
+    membership_number = params.get("membership_number", None)
+    mobile_number = params.get("mobile_number", None)
+
+    if year:
+        membership_fees = membership_fees.filter(year=year)
+
+    if fee_status:
+        membership_fees = membership_fees.filter(fee_status=fee_status)
+
+    if member_id:
+        membership_fees = membership_fees.filter(member_id=member_id)
+
+    if membership_number:
+        membership_fees = membership_fees.filter(member__membership_number=membership_number.strip())
+
+    if mobile_number:
+        membership_fees = membership_fees.filter(member__mobile_number=mobile_number.strip())
+
+    return membership_fees
+
+def get_member_fingerprint(request, member_id):
+    fields, expand = get_field_params(request.GET)
+    if settings.SHARED_CACHE and fields is None and expand is None:
+        # Read off the cached document, a conditional GET for a cached member makes no queries
+        document = get_member_document('id', member_id)
+        if document is None:
+            return None
+        suspensions = document['current_suspension_history']
+        timestamps = [parse_datetime(row['updated_at']) for row in [document] + list(suspensions)]
+        return {'last_modified': max(timestamps), 'suspensions': len(suspensions)}
+    # Otherwise the two columns are enough, suspensions and address edits touch updated_at
+    member = Member.objects.filter(pk=member_id, soft_delete=False).values('updated_at', 'suspended_until').first()
+    if member is None:
+        return None
+    suspended_until = member['suspended_until']
+    return {'last_modified': member['updated_at'], 'suspended': suspended_until is not None and suspended_until >= timezone.now()}
+
+def get_member_list_fingerprint_timeout(fingerprint):
+    timeout = settings.MEMBER_CACHE_TIMEOUT
+    # is_suspended flips when the suspension ends without a version bump, the fingerprint must not outlive it
+    if fingerprint['next_expiry'] is not None:
+        timeout = min(timeout, (fingerprint['next_expiry'] - timezone.now()).total_seconds())
+    return max(int(timeout), 1)
+
+def get_member_list_fingerprint(request):
+    # The count catches rows leaving the filtered set, which need not move last_modified.
+    # Soft-deleted members stay in the aggregate, so a deletion still moves last_modified
+    def compute():
+        members = filter_members(Member.objects.all(), request.GET)
+        return members.aggregate(
+            count=Count('id', filter=Q(soft_delete=False)),
+            last_modified=Max('updated_at'),
+            next_expiry=Min('suspended_until', filter=Q(soft_delete=False, suspended_until__gte=timezone.now())),
         )
-    except Exception as e:
-        # This is a catch all exception, edit this part to fit your needs.
-        print("Something Happened: ", e)
-        raise e
-    
-    return filename
-
-
-def upload_and_get_url(file):
-    if file:
-        if allowed_file(file.name):
-            output = upload_file_to_s3(file)
-            if output:
-                bucket = os.getenv("AWS_S3_BUCKET_NAME")
-                BASE_URL = 'members/'
-                return f'https://{bucket}.s3.amazonaws.com/{BASE_URL}{output}'
-        else:
-            raise ValueError(f"Incorrect File Type")
-    # Return None if the file is not provided or is of incorrect type
-    return None
+    return get_versioned('member-list-fingerprint', request, compute, get_member_list_fingerprint_timeout)
+
+def get_membership_fee_fingerprint(request):
+    def compute():
+        membership_fees = filter_membership_fees(MembershipFee.objects.all(), request.GET)
+        fingerprint = membership_fees.aggregate(
+            count=Count('id', filter=Q(member__soft_delete=False)),
+            fees_modified=Max('updated_at'),
+            members_modified=Max('member__updated_at'),
+        )
+        fingerprint['last_modified'] = max(filter(None, [fingerprint['fees_modified'], fingerprint['members_modified']]), default=None)
+        return fingerprint
+    try:
+        return get_versioned('membership-fee-fingerprint', request, compute)
+    except ValidationError:
+        # left to the view to reject
+        return None
+
+def get_membership_fee_history_fingerprint(request, member_id):
+    return MembershipFee.objects.filter(member_id=member_id).aggregate(count=Count('id'), last_modified=Max('updated_at'))
+
+ARREARS_ORDERING_FIELDS = ('due_years', 'oldest_due_year', 'total_paid')
+
+def get_arrears_ordering(value):
+    """Maps an `ordering` param such as "-due_years" to a unique keyset ordering, None if unknown."""
+    value = value or '-due_years'
+    if value.lstrip('-') not in ARREARS_ORDERING_FIELDS:
+        return None
+    return (value, 'member_id')
+
+def get_membership_arrears(params):
+    """
+    One row per member with unpaid years: the number of due years, the oldest
+    one and the total paid so far, aggregated in a single GROUP BY over the fees.
+    """
+    due, paid = Q(fee_status=MembershipFee.DUE), Q(fee_status=MembershipFee.PAID)
+    membership_fees = MembershipFee.objects.filter(member__soft_delete=False)
+
+    halqa = params.get("halqa", None)
+    city = params.get("city", None)
+    member_type = params.get("member_type", None)
+    if halqa:
+        membership_fees = membership_fees.filter(member__address__current_halqa__icontains=halqa)
+    if city:
+        membership_fees = membership_fees.filter(member__address__current_city__icontains=city)
+    if member_type:
+        membership_fees = membership_fees.filter(member__member_type=member_type)
+
+    # the member columns depend on member_id alone, grouping by them adds no groups
+    return membership_fees.values(
+        'member_id', 'member__name', 'member__surname', 'member__membership_number', 'member__mobile_number',
+        'member__member_type', 'member__address__current_city', 'member__address__current_halqa',
+    ).annotate(
+        due_years=Count('id', filter=due),
+        oldest_due_year=Min('year', filter=due),
+        total_paid=Coalesce(Sum('amount', filter=paid), Value(Decimal('0')), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    ).filter(due_years__gt=0)
 
 def get_members_corrected_data(data):
     address = {
@@ -75,6 +484,21 @@ def get_members_corrected_data(data):
     data["address"] = address
     return data
 
+def get_initial_membership_fees(member, user):
+    # One ledger row per year since joining, lifetime members and patrons have nothing due
+    exempt = member.member_type in [Member.LIFETIME, Member.SARPARAST]
+    return [
+        MembershipFee(
+            member=member,
+            year=str(year),
+            reference_number='-' if exempt else None,
+            fee_status=MembershipFee.PAID if exempt else MembershipFee.DUE,
+            created_by=user,
+            updated_by=user,
+        )
+        for year in range(member.joining_date.year, date.today().year + 1)
+    ]
+
 def get_membership_fee_details(result_page):
     results = []
     for membership_fee in result_page:
@@ -0,0 +1,56 @@
+import re
+import unicodedata
+from django.db import connections
+from django.db.models import Q, Case, When, Value, IntegerField
+
+SEARCH_DOCUMENT_FIELDS = ('name', 'surname', 'father_name')
+
+def normalize_search_text(value):
+    # lower case, accents stripped, punctuation folded into single spaces
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    value = re.sub(r'[^\w\s]', ' ', value.lower())
+    return ' '.join(value.split())
+
+def build_search_document(member):
+    values = [getattr(member, field) for field in SEARCH_DOCUMENT_FIELDS]
+    return normalize_search_text(' '.join(value for value in values if value))
+
+def search_members(queryset, query):
+    """
+    Filters `queryset` down to the members matching `query` and orders them by
+    relevance, most recent first on ties.
+
+    On PostgreSQL matching uses the pg_trgm index on `search_document`, so
+    misspelt names still match through word similarity. Other databases fall back
+    to matching every term as a substring of the document.
+    """
+    terms = normalize_search_text(query)
+    if not terms:
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        return postgres_search(queryset, terms)
+    return fallback_search(queryset, terms)
+
+def postgres_search(queryset, terms):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    return queryset.filter(
+        Q(search_document__contains=terms) | Q(search_document__trigram_word_similar=terms)
+    ).annotate(
+        search_rank=TrigramWordSimilarity(terms, 'search_document')
+    ).order_by('-search_rank', '-created_at')
+
+def fallback_search(queryset, terms):
+    condition = Q()
+    for term in terms.split():
+        condition &= Q(search_document__contains=term)
+    return queryset.filter(condition).annotate(
+        search_rank=Case(
+            When(search_document=terms, then=Value(3)),
+            When(search_document__startswith=terms, then=Value(2)),
+            When(search_document__contains=terms, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    ).order_by('-search_rank', '-created_at')
@@ -1,11 +1,17 @@
 from rest_framework import serializers
-from .models import User, Member, Address, MembershipFee, Suspension
-from .schema import upload_and_get_url
+from .models import User, Member, Address, MembershipFee, Suspension, ExportJob, normalize_suspension_end_date
+from .schema import allowed_file, schedule_member_image_upload, get_member_filters, filter_members
+from .authentication import is_administrator
+from .storage import read_upload_token
+from .countries import get_country_code
+from .images import open_image, get_image_urls, InvalidImage
 from django.contrib.auth.models import Group
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.utils import timezone
-import pycountry
+from django.urls import reverse
+from django.core import signing
+from django.core.exceptions import ValidationError as DjangoValidationError
 
 class CustomLoginSerializer(serializers.Serializer):
     email = serializers.CharField()
@@ -40,6 +46,35 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         model = User
         fields = ['is_active']
         
+class DynamicFieldsMixin:
+    """
+    Lets a request choose what a serializer renders: `fields` is the subset of
+    top-level fields, `expand` the relations rendered as nested objects. Other
+    relations come back as primary keys. With neither, every field is rendered
+    and every relation expanded, as before.
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and expand is None:
+            return
+        rendered, expanded = self.resolve_fields(fields, expand)
+        for name in set(self.fields) - set(rendered):
+            self.fields.pop(name)
+        for name in set(self.expandable_fields) & set(rendered) - set(expanded):
+            self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    @classmethod
+    def resolve_fields(cls, fields=None, expand=None):
+        """(fields rendered, relations expanded) for the requested `fields` and `expand`."""
+        names = list(dict.fromkeys(cls.Meta.fields))
+        if fields is None and expand is None:
+            return names, list(cls.expandable_fields)
+        expand = set(expand or ())
+        rendered = names if fields is None else [name for name in names if name in fields or name in expand]
+        return rendered, [name for name in cls.expandable_fields if name in expand and name in rendered]
+
 class CreatorSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -52,15 +87,17 @@ class AddressSerializer(serializers.ModelSerializer):
         model = Address
         fields = "__all__"
 
-    def get_country_code(self, country_name):
-        country = pycountry.countries.get(name=country_name)
-        return country.alpha_2 if country else None
+    def get_country_code(self, code, country_name):
+        # Codes are stored on save, rows written before that are looked up once per process
+        if code is None:
+            code = get_country_code(country_name)
+        return code or None
 
     def get_permanent_country_code(self, obj):
-        return self.get_country_code(obj.permanent_country)
+        return self.get_country_code(obj.permanent_country_code, obj.permanent_country)
 
     def get_current_country_code(self, obj):
-        return self.get_country_code(obj.current_country)
+        return self.get_country_code(obj.current_country_code, obj.current_country)
     
 class SuspensionSerializer(serializers.ModelSerializer):
     created_by = CreatorSerializer(read_only=True)
@@ -69,7 +106,8 @@ class SuspensionSerializer(serializers.ModelSerializer):
         fields = '__all__'
         # fields = ['start_date', 'end_date', 'reason','created_by','created_at']
 
-class MemberSerializer(serializers.ModelSerializer):
+class MemberSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = ('address', 'created_by', 'approved_by')
     created_by = CreatorSerializer(read_only=True)
     approved_by = CreatorSerializer(read_only=True)
     address = AddressSerializer()
@@ -77,6 +115,7 @@ class MemberSerializer(serializers.ModelSerializer):
     # suspension_history = SuspensionSerializer(many=True, read_only=True)
     # suspension_history = SuspensionSerializer(source='suspensions', many=True, read_only=True)
     current_suspension_history = serializers.SerializerMethodField()
+    image_urls = serializers.SerializerMethodField()
 
     def validate_unique_field(self, display_name, value):
         field_name = display_name.replace(" ", "_")
@@ -98,8 +137,7 @@ class MemberSerializer(serializers.ModelSerializer):
         return obj.is_currently_suspended()
     
     def get_current_suspension_history(self, obj):
-        current_suspensions = obj.suspensions.filter(end_date__gte=timezone.now())
-        return SuspensionSerializer(current_suspensions, many=True).data
+        return SuspensionSerializer(obj.get_current_suspensions(), many=True).data
 
     def validate_mobile_number(self, value):
         return self.validate_unique_field('mobile number', value)
@@ -107,22 +145,35 @@ class MemberSerializer(serializers.ModelSerializer):
     def validate_email(self, value):
         return self.validate_unique_field('email', value)
 
+    def get_image_urls(self, obj):
+        if not obj.image_hash:
+            return None
+        return get_image_urls(obj.image_hash)
+
+    def validate(self, data):
+        image = self.context.get('image')
+        if image:
+            if not allowed_file(getattr(image, 'name', '')):
+                raise serializers.ValidationError({'image_file': 'Incorrect File Type'})
+            try:
+                open_image(image.read())
+            except InvalidImage as e:
+                raise serializers.ValidationError({'image_file': str(e)})
+            image.seek(0)
+        return data
+
     class Meta:
         model = Member
         # fields = "__all__"
-        fields = ['id','name','surname','father_name','date_of_birth','membership_number','place_of_birth','email','mobile_number','address','qualification','profession','is_suspended','current_suspension_history','whatsapp_number','address','soft_delete','is_executive','is_office_bearer','status','member_type','joining_date','created_at','updated_at','created_by','approved_at','approved_by','image_url']
+        fields = ['id','name','surname','father_name','date_of_birth','membership_number','place_of_birth','email','mobile_number','address','qualification','profession','is_suspended','current_suspension_history','whatsapp_number','address','soft_delete','is_executive','is_office_bearer','status','member_type','joining_date','created_at','updated_at','created_by','approved_at','approved_by','image_url','image_urls']
     
     def create(self, validated_data):
         # print("VALIDATED DATA: ", validated_data)
         address_data = validated_data.pop('address')
         address = Address.objects.create(**address_data)
         validated_data['address'] = address
-        # image = validated_data.pop('image_file')
-        if self.context['image']:
-            image = self.context['image']
-            validated_data['image_url'] = upload_and_get_url(image)
-        else:
-            validated_data['image_url'] = None
+        # The photo is uploaded after commit, image_url is set once it is stored
+        validated_data['image_url'] = None
         # Assuming the authenticated user is available in the context
 
         authenticated_user = self.context['request'].user
@@ -131,11 +182,14 @@ class MemberSerializer(serializers.ModelSerializer):
         validated_data['created_by'] = authenticated_user
 
         # Create the Member instance with the assigned creator
-        return Member.objects.create(**validated_data)
+        member = Member.objects.create(**validated_data)
+        if self.context.get('image'):
+            schedule_member_image_upload(member, self.context['image'])
+        return member
 
     def update(self, instance, validated_data):
         # Only allow users in 'admin_group' to update is_verified
-        if 'status' in validated_data and self.context.get('request_user').groups.filter(name='Administrator').exists():
+        if 'status' in validated_data and is_administrator(self.context.get('request_user')):
             instance.is_verified = validated_data['status']
             instance.approved_by = self.context.get('request_user')  # Set updated_by to request.user
             if validated_data['status'] and instance.status != validated_data['status']:
@@ -162,10 +216,135 @@ class MembershipFeeSerializer(serializers.ModelSerializer):
         model = MembershipFee
         fields = '__all__'
 
-class ViewMembershipFeeSerializer(serializers.ModelSerializer):
+class AddMembershipFeeSerializer(serializers.Serializer):
+    MIN_YEAR = 1900
+    MAX_YEAR = 2100
+    # years paid for by one request, each one is a row in the upsert
+    MAX_YEARS = 100
+
+    mobile_number = serializers.CharField()
+    from_year = serializers.IntegerField(min_value=MIN_YEAR, max_value=MAX_YEAR)
+    # exclusive, fees are recorded for from_year up to the year before to_year
+    to_year = serializers.IntegerField(min_value=MIN_YEAR, max_value=MAX_YEAR)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    reference_number = serializers.CharField(max_length=50, required=False, allow_null=True, allow_blank=True)
+
+    def validate(self, data):
+        if data['from_year'] >= data['to_year']:
+            raise serializers.ValidationError({"to_year": "Must be after from_year."})
+        if data['to_year'] - data['from_year'] > self.MAX_YEARS:
+            raise serializers.ValidationError({"to_year": f"At most {self.MAX_YEARS} years can be paid at once."})
+        return data
+
+class BulkMemberSelectionSerializer(serializers.Serializer):
+    member_ids = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False)
+    filters = serializers.DictField(required=False)
+
+    def validate_filters(self, value):
+        # Same filters as member-list, but never an empty selection of every member
+        filters = get_member_filters(value)
+        if not filters:
+            raise serializers.ValidationError("Provide at least one member-list filter.")
+        return filters
+
+    def validate(self, data):
+        if ('member_ids' in data) == ('filters' in data):
+            raise serializers.ValidationError("Provide either member_ids or filters.")
+        return data
+
+    def get_members(self):
+        members = Member.objects.filter(soft_delete=False)
+        if 'member_ids' in self.validated_data:
+            return members.filter(pk__in=self.validated_data['member_ids'])
+        return filter_members(members, self.validated_data['filters'])
+
+    def get_missing_ids(self, found_ids):
+        return [member_id for member_id in self.validated_data.get('member_ids', []) if member_id not in found_ids]
+
+class BulkSuspendSerializer(BulkMemberSelectionSerializer):
+    end_date = serializers.CharField()
+    reason = serializers.CharField()
+
+    def validate_end_date(self, value):
+        try:
+            return normalize_suspension_end_date(value)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+
+class ImageUploadRequestSerializer(serializers.Serializer):
+    file_name = serializers.CharField(max_length=255)
+    content_type = serializers.ChoiceField(choices=['image/png', 'image/jpeg'])
+
+    def validate_file_name(self, value):
+        if not allowed_file(value):
+            raise serializers.ValidationError('Incorrect File Type')
+        return value
+
+class ConfirmImageUploadSerializer(serializers.Serializer):
+    token = serializers.CharField()
+
+    def validate_token(self, value):
+        try:
+            return read_upload_token(value)
+        except signing.BadSignature:
+            raise serializers.ValidationError('Invalid or expired upload token')
+
+class FeeMemberSerializer(serializers.ModelSerializer):
+    # Just what the fee screen shows, everything comes from the joined member and address
+    current_city = serializers.CharField(source='address.current_city', default=None, read_only=True)
+    current_halqa = serializers.CharField(source='address.current_halqa', default=None, read_only=True)
+    is_suspended = serializers.BooleanField(source='is_currently_suspended', read_only=True)
+
+    class Meta:
+        model = Member
+        fields = ['id', 'name', 'surname', 'father_name', 'membership_number', 'mobile_number', 'member_type', 'status', 'current_city', 'current_halqa', 'is_suspended']
+
+class ViewMembershipFeeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = ('member', 'created_by', 'updated_by')
     created_by = CreatorSerializer(read_only=True)
     updated_by = CreatorSerializer(read_only=True)
-    member = MemberSerializer(read_only=True)
+    member = FeeMemberSerializer(read_only=True)
     class Meta:
         model = MembershipFee
-        fields = '__all__'
\ No newline at end of file
+        fields = ['id', 'amount', 'reference_number', 'year', 'fee_status', 'member', 'created_by', 'updated_by', 'created_at', 'updated_at']
+
+class MemberTombstoneSerializer(serializers.ModelSerializer):
+    # What the change feed sends for a soft-deleted member, enough for a client to drop it
+    class Meta:
+        model = Member
+        fields = ['id', 'soft_delete', 'updated_at']
+
+class MemberArrearsSerializer(serializers.Serializer):
+    member_id = serializers.UUIDField()
+    name = serializers.CharField(source='member__name')
+    surname = serializers.CharField(source='member__surname')
+    membership_number = serializers.CharField(source='member__membership_number')
+    mobile_number = serializers.CharField(source='member__mobile_number')
+    member_type = serializers.CharField(source='member__member_type')
+    current_city = serializers.CharField(source='member__address__current_city')
+    current_halqa = serializers.CharField(source='member__address__current_halqa')
+    due_years = serializers.IntegerField()
+    oldest_due_year = serializers.CharField()
+    total_paid = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'file_format', 'filters', 'status', 'total_rows', 'processed_rows', 'progress', 'error', 'download_url', 'created_at', 'completed_at']
+
+    def get_progress(self, obj):
+        if obj.status == ExportJob.COMPLETED:
+            return 100
+        if not obj.total_rows:
+            return 0
+        return min(99, int(obj.processed_rows * 100 / obj.total_rows))
+
+    def get_download_url(self, obj):
+        if obj.status != ExportJob.COMPLETED:
+            return None
+        url = reverse('download_export_job', args=[obj.id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -1,20 +1,72 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Member
-import re
+from django.utils import timezone
+from .models import User, Member, Address, Suspension, MembershipFee, MembershipNumberSequence
+from .search import build_search_document
+from .authentication import invalidate_user_auth_state
+from .cache import invalidate_members_cache, invalidate_member_documents
+
+@receiver(pre_save, sender=Address)
+def update_country_codes(sender, instance, **kwargs):
+    instance.refresh_country_codes()
+
+@receiver(pre_save, sender=Member)
+def update_search_document(sender, instance, **kwargs):
+    instance.search_document = build_search_document(instance)
+
+@receiver(pre_save, sender=Member)
+def generate_membership_number(sender, instance, **kwargs):
+    # Allocated before the INSERT so the number is written with the row itself
+    if instance._state.adding and not instance.membership_number:
+        instance.membership_number = MembershipNumberSequence.objects.reserve()[0]
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+@receiver(post_save, sender=Suspension)
+@receiver(post_delete, sender=Suspension)
+@receiver(post_save, sender=MembershipFee)
+@receiver(post_delete, sender=MembershipFee)
+def clear_member_responses(sender, instance, **kwargs):
+    # Queryset updates and bulk inserts send no signals, those paths call invalidate_members_cache themselves
+    invalidate_members_cache()
 
 @receiver(post_save, sender=Member)
-def generate_membership_number(sender, instance, created, **kwargs):
-    if created and not instance.membership_number:
-        # Get the last member by membership_number
-        last_member = Member.objects.filter(membership_number__regex=r'^MIT-\d+$').order_by('-membership_number').first()
-        if not last_member:
-            new_number = '00001'
-        else:
-            last_number = re.search(r'\d+$', last_member.membership_number).group()
-            new_number = f'{int(last_number) + 1:05}'
-
-        instance.membership_number = f'MIT-{new_number}'
-        
-        # Avoid recursive saving by using update instead of save
-        Member.objects.filter(id=instance.id).update(membership_number=instance.membership_number)
\ No newline at end of file
+@receiver(post_delete, sender=Member)
+def clear_member_document(sender, instance, **kwargs):
+    invalidate_member_documents([instance.pk])
+
+@receiver(post_save, sender=Suspension)
+@receiver(post_delete, sender=Suspension)
+def touch_suspended_member(sender, instance, **kwargs):
+    # Suspensions and addresses are served as part of the member, so their changes
+    # move Member.updated_at too and the member's ETag and Last-Modified with it
+    Member.objects.filter(pk=instance.member_id).update(updated_at=timezone.now())
+    invalidate_member_documents([instance.member_id])
+
+@receiver(post_save, sender=Address)
+def touch_address_members(sender, instance, created, **kwargs):
+    if not created:
+        member_ids = list(Member.objects.filter(address_id=instance.pk).values_list('pk', flat=True))
+        Member.objects.filter(pk__in=member_ids).update(updated_at=timezone.now())
+        invalidate_member_documents(member_ids)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def clear_user_auth_state(sender, instance, **kwargs):
+    invalidate_user_auth_state(instance.pk)
+
+@receiver(m2m_changed, sender=User.groups.through)
+def clear_group_members_auth_state(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_user_auth_state(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            invalidate_user_auth_state(user_id)
+    elif action == 'pre_clear':
+        # group.user_set.clear() does not say which users it removed
+        for user_id in instance.user_set.values_list('pk', flat=True):
+            invalidate_user_auth_state(user_id)
@@ -0,0 +1,131 @@
+import os
+import shutil
+import threading
+import boto3
+from botocore.exceptions import ClientError
+from functools import lru_cache
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+UPLOAD_TOKEN_SALT = 'members.image-upload'
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    # One client per process: boto3 clients are thread safe and keep a connection
+    # pool, building one per upload repeated the credential lookup and TLS handshake
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.client(
+                "s3",
+                aws_access_key_id=os.getenv('AWS_S3_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_S3_SECRET_ACCESS_KEY'),
+                endpoint_url=os.getenv('AWS_S3_ENDPOINT_URL') or None,
+            )
+    return _s3_client
+
+def make_upload_token(name, content_type):
+    return signing.dumps({'name': name, 'content_type': content_type}, salt=UPLOAD_TOKEN_SALT)
+
+def read_upload_token(token):
+    # Raises signing.BadSignature, or its SignatureExpired subclass, for tokens we did not hand out
+    return signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=settings.IMAGE_UPLOAD_URL_EXPIRY)
+
+class S3Storage:
+    """Stores files in the AWS_S3_BUCKET_NAME bucket, uploads go straight to S3."""
+
+    @property
+    def bucket(self):
+        return os.getenv("AWS_S3_BUCKET_NAME")
+
+    def save(self, name, file, content_type):
+        get_s3_client().upload_fileobj(file, self.bucket, name, ExtraArgs={"ContentType": content_type})
+        return name
+
+    def exists(self, name):
+        try:
+            get_s3_client().head_object(Bucket=self.bucket, Key=name)
+        except ClientError:
+            return False
+        return True
+
+    def size(self, name):
+        try:
+            return get_s3_client().head_object(Bucket=self.bucket, Key=name)['ContentLength']
+        except ClientError:
+            return None
+
+    def read(self, name):
+        return get_s3_client().get_object(Bucket=self.bucket, Key=name)['Body'].read()
+
+    def delete(self, name):
+        get_s3_client().delete_object(Bucket=self.bucket, Key=name)
+
+    def url(self, name):
+        endpoint_url = os.getenv('AWS_S3_ENDPOINT_URL')
+        if endpoint_url:
+            return f'{endpoint_url.rstrip("/")}/{self.bucket}/{name}'
+        return f'https://{self.bucket}.s3.amazonaws.com/{name}'
+
+    def get_upload_url(self, name, content_type, request=None):
+        url = get_s3_client().generate_presigned_url(
+            'put_object',
+            Params={'Bucket': self.bucket, 'Key': name, 'ContentType': content_type},
+            ExpiresIn=settings.IMAGE_UPLOAD_URL_EXPIRY,
+        )
+        return {'url': url, 'method': 'PUT', 'headers': {'Content-Type': content_type}}
+
+class LocalFileStorage:
+    """
+    Stores files under MEDIA_ROOT, for development and tests. Direct uploads are
+    PUT to a signed URL on this API, standing in for a presigned S3 URL.
+    """
+
+    def path(self, name):
+        return os.path.join(settings.MEDIA_ROOT, name)
+
+    def save(self, name, file, content_type):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as output:
+            shutil.copyfileobj(file, output)
+        return name
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def size(self, name):
+        try:
+            return os.path.getsize(self.path(name))
+        except FileNotFoundError:
+            return None
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as file:
+            return file.read()
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def url(self, name):
+        return f'{settings.MEDIA_URL}{name}'
+
+    def get_upload_url(self, name, content_type, request=None):
+        url = reverse('local_image_upload', args=[make_upload_token(name, content_type)])
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return {'url': url, 'method': 'PUT', 'headers': {'Content-Type': content_type}}
+
+@lru_cache(maxsize=None)
+def load_storage(path):
+    return import_string(path)()
+
+def get_storage():
+    return load_storage(settings.MEMBER_STORAGE_BACKEND)
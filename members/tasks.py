@@ -0,0 +1,27 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='members-worker')
+    return _executor
+
+def run_task(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # worker threads open their own connections, don't leave them dangling
+        connections.close_all()
+
+def submit_task(func, *args):
+    # With BACKGROUND_WORKERS = 0 tasks run inline, in the caller's thread
+    if settings.BACKGROUND_WORKERS <= 0:
+        return func(*args)
+    return get_executor().submit(run_task, func, *args)
@@ -1,3 +1,1464 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from unittest import skipUnless, mock
+from django.db import connection, connections, IntegrityError, DatabaseError
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, clear_url_caches, NoReverseMatch
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import Group
+from django.utils import timezone
+from rest_framework.test import APIClient
+from datetime import datetime, timedelta
+import csv
+import time
+import importlib
+import os
+import io
+import zipfile
+import shutil
+import tempfile
+import threading
+import xlsxwriter
+import pycountry
+from botocore.exceptions import ClientError
+from PIL import Image
 
-# Create your tests here.
+from .models import User, Member, Address, Suspension, MembershipFee, ExportJob, MembershipNumberSequence
+from .search import normalize_search_text
+from .schema import process_uploaded_member_image, encode_cursor, get_member_list_queryset, get_membership_fee_list_queryset, MembersKeysetPagination
+from .images import store_member_image, get_derivative_name, InvalidImage
+from .storage import get_storage, read_upload_token
+from .countries import get_country_code
+from .authentication import get_user_auth_state
+from .exports import EXPORT_HEADERS, XLSX_CONTENT_TYPE
+from .importers import MemberImporter
+from .serializers import MemberSerializer, ViewMembershipFeeSerializer
+from .cache import LocalLRUCache, get_response_cache, get_member_document_timeout, get_member_lookup_queryset
+
+
+def create_address(**kwargs):
+    data = {
+        'permanent_country': 'India',
+        'permanent_state': 'Karnataka',
+        'permanent_city': 'Bhatkal',
+        'permanent_address': 'Main Road',
+        'permanent_halqa': 'Jamia',
+        'current_country': 'India',
+        'current_state': 'Karnataka',
+        'current_city': 'Bhatkal',
+        'current_address': 'Main Road',
+        'current_halqa': 'Jamia',
+    }
+    data.update(kwargs)
+    return Address.objects.create(**data)
+
+
+def create_member(user, **kwargs):
+    data = {
+        'name': 'Member',
+        'surname': 'Test',
+        'father_name': 'Father',
+        'address': create_address(),
+        'created_by': user,
+        'approved_by': user,
+    }
+    data.update(kwargs)
+    return Member.objects.create(**data)
+
+
+def make_image(image_format='PNG', size=(800, 600), color='red'):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, image_format)
+    return output.getvalue()
+
+
+class MemberTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='admin@example.com', password='secret', full_name='Admin', mobile_number='9000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def suspend(self, member, days=10):
+        member.suspend(timezone.now() + timedelta(days=days), 'Test', self.user)
+        return member.suspensions.latest('created_at')
+
+    def count_queries(self, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+
+@override_settings(SHARED_CACHE=True)
+class MemberListQueryCountTests(MemberTestCase):
+    def test_member_list_query_count_is_constant(self):
+        member = create_member(self.user, mobile_number='9100000000')
+        self.suspend(member)
+        small = self.count_queries(reverse('member-list'))
+
+        for index in range(10):
+            member = create_member(self.user, mobile_number=f'92000000{index:02}')
+            self.suspend(member)
+            self.suspend(member, days=20)
+        large = self.count_queries(reverse('member-list'))
+
+        self.assertEqual(small, large)
+
+    def test_member_list_serializes_current_suspensions(self):
+        suspended = create_member(self.user, name='Suspended', mobile_number='9100000001')
+        create_member(self.user, name='Active', mobile_number='9100000002')
+        suspension = self.suspend(suspended)
+        expired = self.suspend(suspended)
+        expired.end_date = timezone.now() - timedelta(days=1)
+        expired.save()
+
+        response = self.client.get(reverse('member-list'))
+        results = {row['name']: row for row in response.data['results']}
+
+        self.assertTrue(results['Suspended']['is_suspended'])
+        self.assertEqual([row['id'] for row in results['Suspended']['current_suspension_history']], [str(suspension.id)])
+        self.assertFalse(results['Active']['is_suspended'])
+        self.assertEqual(results['Active']['current_suspension_history'], [])
+
+    def test_suspended_member_list_query_count_is_constant(self):
+        self.suspend(create_member(self.user, mobile_number='9100000003'))
+        small = self.count_queries(reverse('suspended-member-list'))
+
+        for index in range(10):
+            self.suspend(create_member(self.user, mobile_number=f'93000000{index:02}'))
+        large = self.count_queries(reverse('suspended-member-list'))
+
+        self.assertEqual(small, large)
+
+    def test_get_member_query_count(self):
+        member = create_member(self.user, mobile_number='9100000004')
+        self.suspend(member)
+        self.suspend(member, days=5)
+
+        # member with joined relations, plus one query for current suspensions
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('get_member', args=[member.id]))
+        self.assertEqual(len(response.data['current_suspension_history']), 2)
+
+
+@override_settings(SHARED_CACHE=True)
+class MemberResponseCacheTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        get_response_cache().clear()
+        self.member = create_member(self.user, name='Cached', mobile_number='9140000001')
+
+    def get(self, data=None):
+        response = self.client.get(reverse('member-list'), data)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeated_request_is_served_from_cache(self):
+        self.assertEqual(self.get({'halqa': 'jamia', 'page_size': 5})['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.get({'page_size': 5, 'halqa': 'jamia'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['results'][0]['name'], 'Cached')
+        self.assertEqual(self.get({'halqa': 'other'})['X-Cache'], 'MISS')
+
+        stats = self.client.get(reverse('member_cache_stats')).data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_member_changes_invalidate(self):
+        self.get()
+        self.member.name = 'Renamed'
+        self.member.save()
+        response = self.get()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Renamed')
+
+        self.suspend(self.member)
+        self.assertTrue(self.get().data['results'][0]['is_suspended'])
+        # queryset updates send no signals
+        self.member.lift_suspension()
+        self.assertFalse(self.get().data['results'][0]['is_suspended'])
+
+    @override_settings(SHARED_CACHE=False)
+    def test_nothing_is_cached_without_a_shared_cache(self):
+        self.get()
+        response = self.get()
+        self.assertNotIn('X-Cache', response)
+        # an update sends no signals, only an uncached read sees it
+        Member.objects.filter(pk=self.member.pk).update(name='Renamed')
+        self.assertEqual(self.get().data['results'][0]['name'], 'Renamed')
+        self.assertEqual(self.client.get(reverse('get_member', args=[self.member.id])).data['name'], 'Renamed')
+
+    def test_local_cache_evicts_least_recently_used(self):
+        with override_settings(MEMBER_CACHE_MAX_ENTRIES=2):
+            local = LocalLRUCache()
+        local.set('a', 1, 60)
+        local.set('b', 2, 60)
+        local.get('a')
+        local.set('c', 3, 60)
+        self.assertEqual((local.get('a'), local.get('b'), local.get('c')), (1, None, 3))
+        local.set('d', 4, -1)
+        self.assertIsNone(local.get('d'))
+
+
+@override_settings(SHARED_CACHE=True)
+class MemberDocumentCacheTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member = create_member(self.user, name='Front', mobile_number='9150000001')
+
+    def lookups(self):
+        return {
+            'id': reverse('get_member', args=[self.member.id]),
+            'mobile': reverse('member_by_mobile', args=[' 9150000001 ']),
+            'number': reverse('member_by_member_id', args=[self.member.membership_number]),
+        }
+
+    def get_name(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data.get('result', response.data)['name']
+
+    def test_repeated_lookups_make_no_queries(self):
+        urls = self.lookups()
+        self.get_name(urls['mobile'])
+        # the first lookup filled the entries for every key
+        with self.assertNumQueries(0):
+            for url in urls.values():
+                self.assertEqual(self.get_name(url), 'Front')
+
+    def test_changes_invalidate_the_document(self):
+        urls = self.lookups()
+        self.get_name(urls['id'])
+        self.member.name = 'Renamed'
+        self.member.save()
+        self.assertEqual(self.get_name(urls['number']), 'Renamed')
+
+        self.member.address.current_halqa = 'North'
+        self.member.address.save()
+        self.assertEqual(self.client.get(urls['id']).data['address']['current_halqa'], 'North')
+
+        self.suspend(self.member)
+        self.assertTrue(self.client.get(urls['id']).data['is_suspended'])
+        Member.objects.filter(pk=self.member.pk).bulk_lift_suspension()
+        self.assertFalse(self.client.get(urls['id']).data['is_suspended'])
+
+    def test_old_mobile_number_is_not_served(self):
+        urls = self.lookups()
+        self.get_name(urls['mobile'])
+        self.member.mobile_number = '9150000002'
+        self.member.save()
+        self.assertEqual(self.client.get(urls['mobile']).status_code, 404)
+        self.assertEqual(self.get_name(reverse('member_by_mobile', args=['9150000002'])), 'Front')
+
+        self.member.soft_delete = True
+        self.member.save()
+        self.assertEqual(self.client.get(urls['id']).status_code, 404)
+
+    def test_suspended_document_expires_with_the_suspension(self):
+        self.assertEqual(get_member_document_timeout(self.member), 300)
+        self.member.suspend(timezone.now() + timedelta(seconds=30), 'Test', self.user)
+        self.assertLessEqual(get_member_document_timeout(self.member), 30)
+
+
+@override_settings(SHARED_CACHE=True)
+class ConditionalGetTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member = create_member(self.user, mobile_number='9160000001')
+        MembershipFee.objects.create(member=self.member, year='2024', created_by=self.user, updated_by=self.user)
+
+    def revalidate(self, url, data=None):
+        response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('Last-Modified', response)
+        return self.client.get(url, data, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_resources_are_not_modified(self):
+        urls = [
+            reverse('get_member', args=[self.member.id]),
+            reverse('member-list'),
+            reverse('get_membership_details'),
+            reverse('get_membership_fees_history', args=[self.member.id]),
+        ]
+        for url in urls:
+            response = self.revalidate(url)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.content, b'')
+
+    def test_not_modified_skips_serialization(self):
+        url = reverse('get_member', args=[self.member.id])
+        etag = self.client.get(url)['ETag']
+        with mock.patch('members.views.get_member_document') as get_document, self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        get_document.assert_not_called()
+
+        url = reverse('get_membership_details')
+        etag = self.client.get(url)['ETag']
+        with mock.patch('members.views.ViewMembershipFeeSerializer') as serializer, self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        serializer.assert_not_called()
+
+    def test_changes_and_other_pages_get_a_new_etag(self):
+        url = reverse('member-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, {'page_size': 1}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.suspend(self.member)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = reverse('get_member', args=[self.member.id])
+        etag = self.client.get(url)['ETag']
+        self.member.address.current_city = 'Murdeshwar'
+        self.member.address.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = reverse('get_membership_details')
+        etag = self.client.get(url)['ETag']
+        self.member.soft_delete = True
+        self.member.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_rows_leaving_the_filter_get_a_new_etag(self):
+        newest = create_member(self.user, mobile_number='9160000002')
+        url = reverse('member-list')
+        # updates that leave updated_at alone, so only the row count can tell
+        etag = self.client.get(url, {'status': Member.PENDING})['ETag']
+        Member.objects.filter(pk=self.member.pk).update(status=Member.APPROVED)
+        self.assertEqual(self.client.get(url, {'status': Member.PENDING}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(url)['ETag']
+        Member.objects.filter(pk=self.member.pk).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        fee = MembershipFee.objects.create(member=newest, year='2024', created_by=self.user, updated_by=self.user)
+        url = reverse('get_membership_details')
+        etag = self.client.get(url, {'fee_status': MembershipFee.DUE})['ETag']
+        MembershipFee.objects.filter(pk=fee.pk).update(fee_status=MembershipFee.PAID)
+        self.assertEqual(self.client.get(url, {'fee_status': MembershipFee.DUE}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_suspension_running_out_gets_a_new_etag(self):
+        url = reverse('member-list')
+        now = timezone.now()
+        self.member.suspend(now + timedelta(seconds=60), 'Test', self.user)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # the cached fingerprint expires with the suspension, no version bump needed
+        later = time.monotonic() + 120
+        with mock.patch('members.cache.time.monotonic', return_value=later), mock.patch('django.utils.timezone.now', return_value=now + timedelta(seconds=120)):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(SYNC_SAFETY_LAG=0)
+class MemberChangesTests(MemberTestCase):
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(reverse('member_changes'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def sync_all(self, cursor=None, **params):
+        changes = {'members': [], 'membership_fees': [], 'suspensions': []}
+        while True:
+            data = self.sync(cursor, **params)
+            for stream in changes:
+                changes[stream] += data[stream]
+            cursor = data['cursor']
+            if not data['has_more']:
+                return changes, cursor
+
+    def test_feed_returns_only_changes_since_the_cursor(self):
+        members = [create_member(self.user, mobile_number=f'91800000{index:02}') for index in range(5)]
+        changes, cursor = self.sync_all(page_size=2)
+        self.assertEqual(sorted(row['id'] for row in changes['members']), sorted(str(member.id) for member in members))
+
+        self.assertEqual(self.sync(cursor)['members'], [])
+        members[0].name = 'Renamed'
+        members[0].save()
+        members[1].soft_delete = True
+        members[1].save()
+        self.suspend(members[2])
+        MembershipFee.objects.create(member=members[3], year='2024', created_by=self.user, updated_by=self.user)
+
+        changes, _ = self.sync_all(cursor)
+        rows = {row['id']: row for row in changes['members']}
+        self.assertEqual(set(rows), {str(members[index].id) for index in range(3)})
+        self.assertEqual(rows[str(members[0].id)]['name'], 'Renamed')
+        self.assertEqual(rows[str(members[1].id)], {'id': str(members[1].id), 'soft_delete': True, 'updated_at': rows[str(members[1].id)]['updated_at']})
+        self.assertEqual([row['member'] for row in changes['suspensions']], [str(members[2].id)])
+        self.assertEqual([row['year'] for row in changes['membership_fees']], ['2024'])
+
+    def test_recent_rows_wait_for_the_safety_lag(self):
+        create_member(self.user, mobile_number='9180000100')
+        with override_settings(SYNC_SAFETY_LAG=60):
+            self.assertEqual(self.sync()['members'], [])
+        self.assertEqual(len(self.sync()['members']), 1)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('member_changes'), {'cursor': 'nope'}).status_code, 404)
+        for cursor in ({'members': ['bad', 'bad']}, {'suspensions': [1, 2]}, {'membership_fees': ['2024-01-01T00:00:00+00:00']}, {'others': []}, ['bad']):
+            response = self.client.get(reverse('member_changes'), {'cursor': encode_cursor(cursor)})
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+@override_settings(SHARED_CACHE=True)
+class SparseFieldsetTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member = create_member(self.user, name='Sparse', mobile_number='9190000001')
+        self.suspend(self.member)
+        MembershipFee.objects.create(member=self.member, year='2024', created_by=self.user, updated_by=self.user)
+
+    def test_member_list_loads_only_requested_fields(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('member-list'), {'fields': 'id,name,is_suspended'})
+        self.assertEqual(response.data['results'], [{'id': str(self.member.id), 'name': 'Sparse', 'is_suspended': True}])
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('members_suspension', sql)
+        self.assertNotIn('search_document', sql)
+
+    def test_relations_are_ids_unless_expanded(self):
+        row = self.client.get(reverse('member-list'), {'fields': 'id,address,created_by'}).data['results'][0]
+        self.assertEqual((row['address'], row['created_by']), (self.member.address_id, self.user.id))
+
+        row = self.client.get(reverse('member-list'), {'fields': 'id', 'expand': 'address'}).data['results'][0]
+        self.assertEqual(set(row), {'id', 'address'})
+        self.assertEqual(row['address']['current_city'], 'Bhatkal')
+
+    def test_single_member_lookups(self):
+        url = reverse('get_member', args=[self.member.id])
+        # with a cold cache the full document is never built, the ETag comes off two columns
+        with mock.patch('members.schema.get_member_document') as get_document, self.assertNumQueries(2):
+            response = self.client.get(url, {'fields': 'name,is_suspended'})
+        get_document.assert_not_called()
+        self.assertEqual(response.data, {'name': 'Sparse', 'is_suspended': True})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, {'fields': 'name,is_suspended'}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # plus the suspensions, only when they are asked for
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'fields': 'current_suspension_history'})
+        self.assertEqual(len(response.data['current_suspension_history']), 1)
+
+        response = self.client.get(reverse('member_by_mobile', args=['9190000001']), {'fields': 'membership_number'})
+        self.assertEqual(response.data['result'], {'membership_number': self.member.membership_number})
+        self.assertIn('address', self.client.get(url).data)
+
+    def test_fee_listing(self):
+        row = self.client.get(reverse('get_membership_details'), {'fields': 'year,member'}).data['results'][0]
+        self.assertEqual(row, {'year': '2024', 'member': self.member.id})
+        row = self.client.get(reverse('get_membership_details'), {'fields': 'year', 'expand': 'member'}).data['results'][0]
+        self.assertEqual(row['member']['name'], 'Sparse')
+
+
+class KeysetPaginationTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.members = [create_member(self.user, name=f'Member {index}', mobile_number=f'94000000{index:02}') for index in range(7)]
+        # newest first, ties on created_at are broken by id
+        self.expected = [str(member.id) for member in sorted(self.members, key=lambda member: (member.created_at, member.id), reverse=True)]
+
+    def fetch(self, url, data=None):
+        response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_walks_forward_and_backward(self):
+        page = self.fetch(reverse('member-list'), {'pagination': 'cursor', 'page_size': 3})
+        self.assertNotIn('count', page)
+        self.assertIsNone(page['previous'])
+        seen = [row['id'] for row in page['results']]
+        pages = [page]
+        while page['next']:
+            page = self.fetch(page['next'])
+            seen += [row['id'] for row in page['results']]
+            pages.append(page)
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(len(pages), 3)
+
+        previous = self.fetch(pages[2]['previous'])
+        self.assertEqual(previous['results'], pages[1]['results'])
+        first = self.fetch(previous['previous'])
+        self.assertEqual(first['results'], pages[0]['results'])
+        self.assertIsNone(first['previous'])
+
+    def test_ties_on_created_at_are_not_skipped(self):
+        Member.objects.update(created_at=timezone.now())
+        expected = sorted(self.expected, reverse=True)
+        page = self.fetch(reverse('member-list'), {'pagination': 'cursor', 'page_size': 2})
+        seen = [row['id'] for row in page['results']]
+        while page['next']:
+            page = self.fetch(page['next'])
+            seen += [row['id'] for row in page['results']]
+        self.assertEqual(seen, expected)
+
+    def test_cursor_mode_skips_count(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('member-list'), {'pagination': 'cursor'})
+        # the paginator's COUNT(*), the ETag fingerprint counts its rows on purpose
+        self.assertFalse(any('"__count"' in query['sql'] for query in context.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('member-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_bad_values(self):
+        for position in (['garbage', 'x'], [1, 2], [None, None], ['2024-01-01T00:00:00+00:00', 'not-a-uuid']):
+            response = self.client.get(reverse('member-list'), {'cursor': encode_cursor({'p': position})})
+            self.assertEqual(response.status_code, 404, position)
+
+    def test_user_listing(self):
+        users = self.fetch(reverse('get_users'), {'pagination': 'cursor'})
+        self.assertEqual([row['id'] for row in users['results']], [str(self.user.id)])
+        self.assertIsNone(users['next'])
+
+    def test_empty_listing(self):
+        Member.objects.update(soft_delete=True)
+        self.assertEqual(self.fetch(reverse('member-list')), {'errors': 'No Member Found'})
+        self.assertEqual(self.fetch(reverse('member-list'), {'pagination': 'cursor'}), {'errors': 'No Member Found'})
+
+
+class SuspensionStateTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member = create_member(self.user, mobile_number='9150000001')
+
+    def test_suspend_keeps_the_latest_end_date(self):
+        self.suspend(self.member, days=20)
+        until = self.member.suspended_until
+        self.suspend(self.member, days=5)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.suspended_until, until)
+        self.assertTrue(self.member.is_currently_suspended())
+
+    def test_lift_suspension(self):
+        self.suspend(self.member)
+        self.member.lift_suspension()
+        self.member.refresh_from_db()
+        self.assertIsNone(self.member.suspended_until)
+        self.assertFalse(self.member.suspensions.filter(end_date__gt=timezone.now()).exists())
+
+    def test_unsuspended_member_needs_no_suspension_query(self):
+        member = Member.objects.get(pk=self.member.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(member.is_currently_suspended())
+            self.assertEqual(member.get_current_suspensions(), [])
+
+    def test_suspend_member_view(self):
+        response = self.client.post(reverse('suspend_member'), {'member_id': self.member.id, 'end_date': '2999-01-01', 'reason': 'Test'})
+        self.assertEqual(response.status_code, 200)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.suspended_until.year, 2999)
+
+        response = self.client.post(reverse('suspend_member'), {'member_id': self.member.id, 'end_date': 'soon', 'reason': 'Test'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_suspended_filters(self):
+        active = create_member(self.user, name='Active', mobile_number='9150000002')
+        self.suspend(self.member)
+        expired = create_member(self.user, name='Expired', mobile_number='9150000003')
+        Member.objects.filter(pk=expired.pk).update(suspended_until=timezone.now() - timedelta(days=1))
+
+        response = self.client.get(reverse('suspended-member-list'))
+        self.assertEqual([row['id'] for row in response.data['results']], [str(self.member.id)])
+        response = self.client.get(reverse('member-list'), {'suspended': 'true'})
+        self.assertEqual([row['id'] for row in response.data['results']], [str(self.member.id)])
+        response = self.client.get(reverse('member-list'), {'suspended': 'false'})
+        self.assertEqual({row['id'] for row in response.data['results']}, {str(active.id), str(expired.id)})
+
+
+@override_settings(SHARED_CACHE=True)
+class BulkSuspensionTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.members = [
+            create_member(self.user, mobile_number=f'91700000{index:02}', address=create_address(current_halqa='Jamia' if index < 3 else 'Other'))
+            for index in range(5)
+        ]
+
+    def post(self, name, data):
+        return self.client.post(reverse(name), data, format='json')
+
+    def test_bulk_suspend_by_ids(self):
+        missing = '00000000-0000-0000-0000-000000000000'
+        ids = [str(member.id) for member in self.members[:2]]
+        get_user_auth_state(self.user.pk)
+        # select, batched insert, conditional update and read back, inside one savepoint
+        with self.assertNumQueries(6):
+            response = self.post('bulk_suspend_members', {'member_ids': ids + [missing], 'end_date': '2999-01-01', 'reason': 'Test'})
+        self.assertEqual(response.status_code, 200)
+        statuses = {row['member_id']: row['status'] for row in response.json()['results']}
+        self.assertEqual(statuses, {ids[0]: 'suspended', ids[1]: 'suspended', missing: 'not_found'})
+        self.assertEqual(Suspension.objects.count(), 2)
+        self.assertEqual(Member.objects.filter(suspended_until__year=2999).count(), 2)
+
+    def test_bulk_suspend_and_lift_by_filter(self):
+        response = self.post('bulk_suspend_members', {'filters': {'halqa': 'Jamia'}, 'end_date': '2999-01-01', 'reason': 'Test'})
+        self.assertEqual(len(response.data['results']), 3)
+
+        response = self.post('bulk_lift_suspensions', {'member_ids': [str(member.id) for member in self.members[2:4]]})
+        statuses = [row['status'] for row in response.data['results']]
+        self.assertEqual(sorted(statuses), ['lifted', 'not_suspended'])
+        self.assertEqual(Member.objects.filter(suspended_until__isnull=False).count(), 2)
+        self.assertEqual(Suspension.objects.filter(end_date__gt=timezone.now()).count(), 2)
+
+    def test_bulk_requires_a_selection(self):
+        self.assertEqual(self.post('bulk_suspend_members', {'end_date': '2999-01-01', 'reason': 'Test'}).status_code, 400)
+        self.assertEqual(self.post('bulk_lift_suspensions', {'filters': {}}).status_code, 400)
+
+
+class ProcessSuspensionsTests(MemberTestCase):
+    def run_command(self, *args):
+        output = io.StringIO()
+        call_command('process_suspensions', *args, stdout=output)
+        return output.getvalue()
+
+    def test_clears_expired_suspensions_in_batches(self):
+        active = create_member(self.user, mobile_number='9160000000')
+        self.suspend(active)
+        for index in range(5):
+            member = create_member(self.user, mobile_number=f'91600000{index + 1:02}')
+            Member.objects.filter(pk=member.pk).update(suspended_until=timezone.now() - timedelta(minutes=1))
+
+        self.assertIn('Expired 5 and resynced 0', self.run_command('--batch-size', '2'))
+        self.assertEqual(Member.objects.filter(suspended_until__isnull=False).get(), active)
+        self.assertIn('Expired 0 and resynced 0', self.run_command())
+
+    def test_resync_fixes_drift(self):
+        untracked = create_member(self.user, mobile_number='9160000010')
+        Suspension.objects.create(member=untracked, end_date=timezone.now() + timedelta(days=3), reason='Test', created_by=self.user, updated_by=self.user)
+        deleted = create_member(self.user, mobile_number='9160000011')
+        self.suspend(deleted)
+        deleted.suspensions.all().delete()
+
+        self.assertIn('resynced 2', self.run_command('--resync'))
+        untracked.refresh_from_db()
+        deleted.refresh_from_db()
+        self.assertEqual(untracked.suspended_until, untracked.suspensions.get().end_date)
+        self.assertIsNone(deleted.suspended_until)
+        self.assertIn('resynced 0', self.run_command('--resync'))
+
+
+class CountryCodeTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        get_country_code.cache_clear()
+
+    def test_codes_are_stored_on_save(self):
+        address = create_address(permanent_country='India', current_country='Atlantis')
+        self.assertEqual((address.permanent_country_code, address.current_country_code), ('IN', ''))
+        address.current_country = 'Saudi Arabia'
+        address.save()
+        self.assertEqual(Address.objects.get(pk=address.pk).current_country_code, 'SA')
+
+    def test_listing_does_no_country_lookups(self):
+        create_member(self.user, address=create_address(current_country='Atlantis'))
+        legacy = create_member(self.user, mobile_number='9190000001')
+        Address.objects.filter(pk=legacy.address_id).update(permanent_country_code=None, current_country_code=None)
+        get_country_code.cache_clear()
+
+        with mock.patch('pycountry.countries.get', wraps=pycountry.countries.get) as lookup:
+            response = self.client.get(reverse('member-list'))
+        # only the legacy row is looked up, once per distinct name
+        self.assertEqual(lookup.call_count, 1)
+        codes = {row['id']: row['address']['current_country_code'] for row in response.data['results']}
+        self.assertEqual(codes[str(legacy.id)], 'IN')
+        self.assertEqual(sorted(codes.values(), key=str), ['IN', None])
+
+
+class MemberSearchTests(MemberTestCase):
+    def search(self, query):
+        response = self.client.get(reverse('member-list'), {'query': query})
+        return [row['name'] for row in response.data.get('results', [])]
+
+    def test_search_document_is_maintained(self):
+        member = create_member(self.user, name='Zaid', surname='Shaikh', father_name='Abdul-Rahmán')
+        self.assertEqual(member.search_document, 'zaid shaikh abdul rahman')
+        member.surname = 'Khan'
+        member.save()
+        member.refresh_from_db()
+        self.assertEqual(member.search_document, 'zaid khan abdul rahman')
+
+    def test_normalize_search_text(self):
+        self.assertEqual(normalize_search_text('  Ábdul   RAHMAN!  '), 'abdul rahman')
+        self.assertEqual(normalize_search_text(None), '')
+
+    def test_results_are_ranked(self):
+        create_member(self.user, name='Abdul', surname='Khan', father_name='Ahmed', mobile_number='9500000001')
+        create_member(self.user, name='Ahmed', surname='Khan', father_name='Yusuf', mobile_number='9500000002')
+        create_member(self.user, name='Yusuf', surname='Patel', father_name='Ali', mobile_number='9500000003')
+
+        self.assertEqual(self.search('ahmed khan'), ['Ahmed', 'Abdul'])
+        self.assertEqual(self.search('KHAN'), ['Ahmed', 'Abdul'])
+        self.assertEqual(self.search('patel'), ['Yusuf'])
+        self.assertEqual(self.search('nobody'), [])
+
+
+class IndexUsageTests(TestCase):
+    """
+    EXPLAIN the queries behind the hot endpoints and fail on sequential scans.
+    PostgreSQL is told to avoid seq scans so that a usable index is always picked.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='admin@example.com', password='secret', full_name='Admin', mobile_number='9000000000')
+        cls.member = create_member(cls.user, mobile_number='9600000001')
+        if connection.vendor == 'postgresql':
+            cls.populate()
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    @classmethod
+    def populate(cls, count=2000):
+        # PostgreSQL plans from statistics, so give it a realistically sized table
+        addresses = Address.objects.bulk_create([
+            Address(permanent_country='India', permanent_state='Karnataka', permanent_city=f'City {index % 50}', permanent_address='Road',
+                    permanent_halqa=f'Halqa {index % 40}', current_country='India', current_state='Karnataka', current_city=f'City {index % 50}',
+                    current_address='Road', current_halqa=f'Halqa {index % 40}')
+            for index in range(count)
+        ])
+        members = Member.objects.bulk_create([
+            Member(name=f'Member {index}', membership_number=f'T-{index}', mobile_number=f'95{index:08}', email=f'member{index}@example.com',
+                   status=Member.REJECTED if index % 100 == 0 else Member.APPROVED, soft_delete=index % 10 == 1,
+                   address=address, created_by=cls.user)
+            for index, address in enumerate(addresses)
+        ])
+        MembershipFee.objects.bulk_create([
+            MembershipFee(member=member, year=str(year), created_by=cls.user, updated_by=cls.user)
+            for member in members for year in range(2015, 2025)
+        ])
+        Suspension.objects.bulk_create([
+            Suspension(member=member, end_date=timezone.now() + timedelta(days=index % 20 - 15), reason='Test', created_by=cls.user, updated_by=cls.user)
+            for index, member in enumerate(members[::5])
+        ])
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+        else:
+            for line in plan.splitlines():
+                if ' SCAN ' in f' {line} ':
+                    self.assertIn('USING', line, plan)
+        # a full scan of some unrelated index also avoids a seq scan, so name the one expected
+        if index is not None:
+            self.assertIn(index, plan)
+
+    def member_list(self, **params):
+        # built the way member-list builds it, with the full default fieldset
+        return get_member_list_queryset(params, *MemberSerializer.resolve_fields())
+
+    def membership_fee_list(self, **params):
+        return get_membership_fee_list_queryset(params, *ViewMembershipFeeSerializer.resolve_fields())
+
+    def test_member_list_queries(self):
+        self.assertUsesIndex(self.member_list()[:12], 'member_active_created_idx')
+        self.assertUsesIndex(self.member_list().order_by(*MembersKeysetPagination.ordering)[:13], 'member_active_created_idx')
+        self.assertUsesIndex(self.member_list(status=Member.REJECTED)[:12], 'member_active_status_idx')
+        self.assertUsesIndex(self.member_list(suspended='true')[:12])
+        self.assertUsesIndex(get_member_lookup_queryset('mobile_number', '9600000001'), 'member_active_mobile_idx')
+        self.assertUsesIndex(get_member_lookup_queryset('membership_number', 'MIT-00001'))
+        self.assertUsesIndex(Member.objects.filter(soft_delete=False, email='member@example.com'), 'member_active_email_idx')
+
+    @skipUnless(connection.vendor == 'postgresql', 'substring filters are only indexed on PostgreSQL')
+    def test_member_list_substring_filters(self):
+        self.assertUsesIndex(self.member_list(city='bhat')[:12], 'address_current_city_trgm')
+        self.assertUsesIndex(self.member_list(halqa='jam')[:12], 'address_current_halqa_trgm')
+        self.assertUsesIndex(self.member_list(mobile_number='9600')[:12], 'member_active_mobile_trgm')
+        self.assertUsesIndex(self.member_list(query='member 12')[:12], 'members_member_search_trgm')
+
+    def test_membership_fee_queries(self):
+        self.assertUsesIndex(self.membership_fee_list()[:12], 'fee_created_idx')
+        self.assertUsesIndex(self.membership_fee_list(year='2024')[:12], 'fee_year_created_idx')
+        self.assertUsesIndex(self.membership_fee_list(fee_status=MembershipFee.PAID)[:12], 'fee_status_created_idx')
+        self.assertUsesIndex(self.membership_fee_list(member_id=str(self.member.pk))[:12])
+        self.assertUsesIndex(self.membership_fee_list(mobile_number='9600000001')[:12], 'member_active_mobile_idx')
+        self.assertUsesIndex(MembershipFee.objects.filter(member=self.member, year='2024'))
+
+    def test_suspension_queries(self):
+        now = timezone.now()
+        self.assertUsesIndex(Suspension.objects.filter(member=self.member, end_date__gte=now), 'suspension_member_end_idx')
+        self.assertUsesIndex(Member.objects.filter(suspended_until__gte=now), 'member_suspended_until_idx')
+
+    def test_change_feed_queries(self):
+        since = timezone.now() - timedelta(hours=1)
+        for model, index in ((Member, 'member_updated_idx'), (MembershipFee, 'fee_updated_idx'), (Suspension, 'suspension_updated_idx')):
+            changes = model.objects.filter(updated_at__gt=since).order_by('updated_at', 'id')[:101]
+            self.assertUsesIndex(changes, index)
+
+
+class MemberExportTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        create_member(self.user, name='Bhatkal', mobile_number='9700000001')
+        create_member(self.user, name='Murdeshwar', mobile_number='9700000002', address=create_address(current_city='Murdeshwar'))
+
+    def test_csv_export_streams_filtered_rows(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('download_member_list'), {'file_format': 'csv', 'city': 'murdesh'})
+            content = b''.join(response.streaming_content).decode()
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], EXPORT_HEADERS)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][EXPORT_HEADERS.index('name')], 'Murdeshwar')
+        self.assertEqual(rows[1][EXPORT_HEADERS.index('current_city')], 'Murdeshwar')
+        self.assertEqual(rows[1][EXPORT_HEADERS.index('date_of_birth')], '')
+
+    def test_xlsx_export(self):
+        response = self.client.get(reverse('download_member_list'))
+        self.assertEqual(response['Content-Type'], XLSX_CONTENT_TYPE)
+        content = b''.join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertIn('Bhatkal', sheet)
+        self.assertIn('Murdeshwar', sheet)
+
+    def test_unsupported_format(self):
+        response = self.client.get(reverse('download_member_list'), {'file_format': 'pdf'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportJobTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_root)
+        settings_override = override_settings(BACKGROUND_WORKERS=0, EXPORT_ROOT=self.export_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.member = create_member(self.user, name='Exported', mobile_number='9710000001')
+        create_member(self.user, name='Elsewhere', mobile_number='9710000002', address=create_address(current_city='Udupi'))
+
+    def submit(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('submit_export_job'), {'file_format': 'csv', **data}, format='json')
+
+    def test_job_runs_and_artifact_downloads(self):
+        response = self.submit(city='bhatkal')
+        self.assertEqual(response.status_code, 202)
+
+        job = self.client.get(reverse('get_export_job', args=[response.data['id']])).data
+        self.assertEqual(job['status'], ExportJob.COMPLETED)
+        self.assertEqual(job['progress'], 100)
+        self.assertEqual(job['total_rows'], 1)
+
+        download = self.client.get(job['download_url'])
+        rows = list(csv.reader(io.StringIO(b''.join(download.streaming_content).decode())))
+        self.assertEqual([row[0] for row in rows], ['name', 'Exported'])
+
+    def test_identical_exports_reuse_the_artifact_until_members_change(self):
+        first = self.submit(city='bhatkal')
+        second = self.submit(city='bhatkal')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertNotEqual(self.submit(city='udupi').data['id'], first.data['id'])
+
+        self.member.name = 'Renamed'
+        self.member.save()
+        third = self.submit(city='bhatkal')
+        self.assertEqual(third.status_code, 202)
+        self.assertNotEqual(third.data['id'], first.data['id'])
+
+    def test_purge_deletes_old_jobs_and_files(self):
+        old = ExportJob.objects.create(file_format=ExportJob.CSV, fingerprint='old', status=ExportJob.COMPLETED, file_name='old.csv', created_by=self.user)
+        recent = ExportJob.objects.create(file_format=ExportJob.CSV, fingerprint='recent', status=ExportJob.COMPLETED, file_name='recent.csv', created_by=self.user)
+        ExportJob.objects.filter(pk=old.pk).update(updated_at=timezone.now() - timedelta(days=30))
+        for file_name in ('old.csv', 'recent.csv', 'crashed.csv.part'):
+            open(os.path.join(self.export_root, file_name), 'w').close()
+        stale = (timezone.now() - timedelta(days=30)).timestamp()
+        os.utime(os.path.join(self.export_root, 'crashed.csv.part'), (stale, stale))
+
+        call_command('purge_exports', days=7, stdout=io.StringIO())
+        self.assertEqual(list(ExportJob.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual(os.listdir(self.export_root), ['recent.csv'])
+
+    def test_download_before_completion(self):
+        job = ExportJob.objects.create(file_format=ExportJob.CSV, fingerprint='pending', created_by=self.user)
+        response = self.client.get(reverse('download_export_job', args=[job.id]))
+        self.assertEqual(response.status_code, 409)
+
+
+class AddMembershipFeeTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member = create_member(self.user, mobile_number='9800000001')
+        self.clerk = User.objects.create_user(email='clerk@example.com', password='secret', full_name='Clerk', mobile_number='9000000001')
+        MembershipFee.objects.create(member=self.member, year='2020', fee_status=MembershipFee.DUE, created_by=self.clerk, updated_by=self.clerk)
+
+    def pay(self, from_year, to_year):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('add_fee'), {
+                'mobile_number': ' 9800000001 ',
+                'from_year': from_year,
+                'to_year': to_year,
+                'amount': '500.00',
+                'reference_number': 'REF-1',
+            })
+        self.assertEqual(response.status_code, 200, response.data)
+        return len(context.captured_queries)
+
+    def test_upserts_existing_and_missing_years(self):
+        self.pay(2018, 2022)
+        fees = {fee.year: fee for fee in MembershipFee.objects.filter(member=self.member)}
+        self.assertEqual(sorted(fees), ['2018', '2019', '2020', '2021'])
+        for fee in fees.values():
+            self.assertEqual(fee.fee_status, MembershipFee.PAID)
+            self.assertEqual(fee.reference_number, 'REF-1')
+            self.assertEqual(fee.updated_by, self.user)
+        self.assertEqual(fees['2020'].created_by, self.clerk)
+
+    def test_query_count_does_not_grow_with_years(self):
+        self.assertEqual(self.pay(2019, 2021), self.pay(1990, 2021))
+        self.assertEqual(MembershipFee.objects.filter(member=self.member).count(), 31)
+
+    def test_rejects_invalid_year_ranges(self):
+        for from_year, to_year in ((2022, 2022), (2022, 2018), (1000, 2020), (2020, 99999), (1900, 2100)):
+            response = self.client.post(reverse('add_fee'), {
+                'mobile_number': '9800000001', 'from_year': from_year, 'to_year': to_year, 'amount': '500.00',
+            })
+            self.assertEqual(response.status_code, 400, (from_year, to_year))
+            self.assertIn('errors', response.data)
+        self.assertEqual(MembershipFee.objects.filter(member=self.member).count(), 1)
+
+    def test_year_rows_are_unique(self):
+        with self.assertRaises(IntegrityError):
+            MembershipFee.objects.create(member=self.member, year='2020', created_by=self.user, updated_by=self.user)
+
+    def test_invalid_payload(self):
+        response = self.client.post(reverse('add_fee'), {'mobile_number': '9800000001', 'from_year': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MembershipFeeListingTests(MemberTestCase):
+    def add_fees(self, count, **kwargs):
+        member = create_member(self.user, mobile_number=kwargs.pop('mobile_number', None))
+        MembershipFee.objects.bulk_create([
+            MembershipFee(member=member, year=str(2000 + year), created_by=self.user, updated_by=self.user, **kwargs)
+            for year in range(count)
+        ])
+        return member
+
+    def test_query_count_is_constant(self):
+        self.add_fees(2)
+        small = self.count_queries(reverse('get_membership_details'))
+        for index in range(5):
+            self.add_fees(4, mobile_number=f'91200000{index:02}')
+        self.suspend(Member.objects.first())
+        large = self.count_queries(reverse('get_membership_details'))
+        self.assertEqual(small, large)
+
+        row = self.client.get(reverse('get_membership_details')).data['results'][0]
+        self.assertEqual(set(row['member']), {'id', 'name', 'surname', 'father_name', 'membership_number', 'mobile_number', 'member_type', 'status', 'current_city', 'current_halqa', 'is_suspended'})
+        self.assertEqual(row['created_by']['full_name'], 'Admin')
+
+    def test_filters(self):
+        member = self.add_fees(3, mobile_number='9120000100', fee_status=MembershipFee.PAID)
+        self.add_fees(3, mobile_number='9120000101')
+
+        def years(**params):
+            response = self.client.get(reverse('get_membership_details'), params)
+            return sorted((row['member']['mobile_number'], row['year']) for row in response.data.get('results', []))
+
+        self.assertEqual(len(years(fee_status='due')), 3)
+        self.assertEqual(years(fee_status='paid', year='2001'), [('9120000100', '2001')])
+        self.assertEqual(len(years(member_id=member.id)), 3)
+        self.assertEqual(len(years(membership_number=member.membership_number)), 3)
+        self.assertEqual(len(years(mobile_number='9120000101')), 3)
+        self.assertEqual(self.client.get(reverse('get_membership_details'), {'member_id': 'nope'}).status_code, 400)
+
+
+class MembershipArrearsTests(MemberTestCase):
+    def add_member(self, mobile_number, due, paid, **kwargs):
+        member = create_member(self.user, mobile_number=mobile_number, address=create_address(**kwargs))
+        fees = [MembershipFee(member=member, year=str(2010 + year), fee_status=MembershipFee.PAID, amount=100) for year in range(paid)]
+        fees += [MembershipFee(member=member, year=str(2020 + year)) for year in range(due)]
+        for fee in fees:
+            fee.created_by = fee.updated_by = self.user
+        MembershipFee.objects.bulk_create(fees)
+        return member
+
+    def report(self, **params):
+        response = self.client.get(reverse('membership_fee_arrears'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_aggregates_per_member(self):
+        member = self.add_member('9130000001', due=3, paid=2)
+        self.add_member('9130000002', due=0, paid=4)
+        with self.assertNumQueries(1):
+            get_user_auth_state(self.user.pk)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('membership_fee_arrears'))
+
+        rows = self.report()['results']
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['member_id'], str(member.id))
+        self.assertEqual((rows[0]['due_years'], rows[0]['oldest_due_year'], rows[0]['total_paid']), (3, '2020', '200.00'))
+
+    def test_ordering_filters_and_cursor(self):
+        for index in range(5):
+            self.add_member(f'91300001{index:02}', due=index + 1, paid=0, current_halqa='North' if index % 2 else 'South')
+
+        data = self.report(page_size=2)
+        self.assertEqual([row['due_years'] for row in data['results']], [5, 4])
+        data = self.client.get(data['next']).json()
+        self.assertEqual([row['due_years'] for row in data['results']], [3, 2])
+        self.assertEqual([row['due_years'] for row in self.client.get(data['previous']).json()['results']], [5, 4])
+
+        self.assertEqual([row['due_years'] for row in self.report(ordering='due_years')['results']], [1, 2, 3, 4, 5])
+        self.assertEqual([row['due_years'] for row in self.report(halqa='north')['results']], [4, 2])
+        self.assertEqual(self.report(member_type=Member.LIFETIME)['results'], [])
+        self.assertEqual(self.client.get(reverse('membership_fee_arrears'), {'ordering': 'name'}).status_code, 400)
+
+    def test_tampered_cursor(self):
+        member = self.add_member('9130000201', due=1, paid=1)
+        for ordering, position in (('-due_years', ['x', 'y']), ('total_paid', ['x', str(member.id)]), ('oldest_due_year', ['2020', 'y']), ('-due_years', ['1'])):
+            response = self.client.get(reverse('membership_fee_arrears'), {'ordering': ordering, 'cursor': encode_cursor({'p': position})})
+            self.assertEqual(response.status_code, 404, (ordering, position))
+
+
+class AddMemberTests(MemberTestCase):
+    def payload(self, **kwargs):
+        data = {
+            'name': 'New',
+            'surname': 'Member',
+            'mobile_number': '9810000001',
+            'joining_date': '2020-01-01',
+            'member_type': Member.ORDINARY,
+            'permanent_country': 'India',
+            'permanent_state': 'Karnataka',
+            'permanent_city': 'Bhatkal',
+            'permanent_halqa': 'Jamia',
+            'permanent_address': 'Main Road',
+            'current_country': 'India',
+            'current_state': 'Karnataka',
+            'current_city': 'Bhatkal',
+            'current_halqa': 'Jamia',
+            'current_address': 'Main Road',
+        }
+        data.update(kwargs)
+        return data
+
+    def add_member(self, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('members'), self.payload(**kwargs))
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(context.captured_queries)
+
+    def test_creates_fee_ledger_in_constant_queries(self):
+        response, recent = self.add_member(joining_date='2020-01-01')
+        _, older = self.add_member(joining_date='1980-01-01', mobile_number='9810000002')
+        self.assertEqual(recent, older)
+
+        fees = MembershipFee.objects.filter(member_id=response.data['id'])
+        self.assertEqual(fees.count(), timezone.now().year - 2020 + 1)
+        self.assertFalse(fees.exclude(fee_status=MembershipFee.DUE).exists())
+
+    def test_lifetime_members_have_nothing_due(self):
+        response, _ = self.add_member(member_type=Member.LIFETIME)
+        fees = MembershipFee.objects.filter(member_id=response.data['id'])
+        self.assertFalse(fees.exclude(fee_status=MembershipFee.PAID, reference_number='-').exists())
+
+    def test_failure_rolls_back_member_and_address(self):
+        with mock.patch('members.views.MembershipFee.objects.bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('members'), self.payload())
+        self.assertFalse(Member.objects.exists())
+        self.assertFalse(Address.objects.exists())
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class MemberImageUploadTests(MemberTestCase):
+    payload = AddMemberTests.payload
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('members.storage.get_s3_client')
+        self.s3_client = patcher.start().return_value
+        self.s3_client.head_object.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        self.addCleanup(patcher.stop)
+
+    def post_with_image(self, name, content=None):
+        image = SimpleUploadedFile(name, content or make_image(), content_type='image/png')
+        return self.client.post(reverse('members'), self.payload(image_file=image))
+
+    def test_upload_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.post_with_image('photo.png')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.data['image_url'])
+        self.s3_client.upload_fileobj.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        # three derivatives, then the original
+        self.assertEqual(self.s3_client.upload_fileobj.call_count, 4)
+        body, bucket, key = self.s3_client.upload_fileobj.call_args.args
+        self.assertEqual(body.read(), make_image())
+        self.assertTrue(key.startswith('members/') and key.endswith('/original.png'))
+        member = Member.objects.get(pk=response.data['id'])
+        self.assertTrue(member.image_url.endswith(key))
+        self.assertIn(member.image_hash, key)
+
+    def test_failed_upload_leaves_member_without_image(self):
+        self.s3_client.upload_fileobj.side_effect = Exception('S3 unavailable')
+        with self.assertLogs('members.schema', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.post_with_image('photo.png')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(Member.objects.get(pk=response.data['id']).image_url)
+
+    def test_rejects_unsupported_file_types(self):
+        response = self.post_with_image('photo.gif')
+        self.assertEqual(response.status_code, 400)
+        response = self.post_with_image('photo.png', b'not an image')
+        self.assertEqual(response.status_code, 400)
+        response = self.post_with_image('photo.png', make_image('GIF'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Member.objects.exists())
+
+
+def reload_urlconf():
+    # the local upload route is only registered for LocalFileStorage, when the URLconf is imported
+    clear_url_caches()
+    for module in ('members.urls', 'tanzeem.urls'):
+        importlib.reload(importlib.import_module(module))
+
+
+@override_settings(BACKGROUND_WORKERS=0)
+class DirectImageUploadTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.member = create_member(self.user, mobile_number='9180000001')
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root, MEMBER_STORAGE_BACKEND='members.storage.LocalFileStorage')
+        settings.enable()
+        self.addCleanup(reload_urlconf)
+        self.addCleanup(settings.disable)
+        reload_urlconf()
+
+    def request_upload(self, **kwargs):
+        data = {'file_name': 'photo.jpg', 'content_type': 'image/jpeg'}
+        data.update(kwargs)
+        return self.client.post(reverse('image_upload_url'), data)
+
+    def test_upload_and_confirm(self):
+        upload = self.request_upload().data
+        self.assertEqual(upload['method'], 'PUT')
+
+        response = APIClient().put(upload['url'], make_image('JPEG'), content_type='image/jpeg')
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('confirm_member_image', args=[self.member.id]), {'token': upload['token']})
+        self.assertEqual(response.status_code, 200)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.image_url, f'/media/members/{self.member.image_hash}/original.jpg')
+        self.assertFalse(get_storage().exists(read_upload_token(upload['token'])['name']))
+
+        image_urls = self.client.get(reverse('get_member', args=[self.member.id])).data['image_urls']
+        self.assertEqual(image_urls['thumbnail'], f'/media/members/{self.member.image_hash}/thumbnail.jpg')
+
+    def test_invalid_upload_is_dropped(self):
+        upload = self.request_upload().data
+        APIClient().put(upload['url'], b'not an image', content_type='image/jpeg')
+        with self.assertLogs('members.schema', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('confirm_member_image', args=[self.member.id]), {'token': upload['token']})
+        self.member.refresh_from_db()
+        self.assertIsNone(self.member.image_url)
+        self.assertFalse(get_storage().exists(read_upload_token(upload['token'])['name']))
+
+    def test_confirm_requires_the_upload(self):
+        upload = self.request_upload().data
+        response = self.client.post(reverse('confirm_member_image', args=[self.member.id]), {'token': upload['token']})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('confirm_member_image', args=[self.member.id]), {'token': 'forged'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_other_file_types(self):
+        self.assertEqual(self.request_upload(file_name='photo.exe').status_code, 400)
+        self.assertEqual(APIClient().put(reverse('local_image_upload', args=['forged']), b'x', content_type='image/jpeg').status_code, 403)
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=1024)
+    def test_rejects_oversized_uploads(self):
+        upload = self.request_upload().data
+        response = APIClient().put(upload['url'], b'x' * 1025, content_type='image/jpeg')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(get_storage().exists(read_upload_token(upload['token'])['name']))
+
+    def test_oversized_objects_are_never_read(self):
+        upload = self.request_upload().data
+        APIClient().put(upload['url'], make_image('JPEG'), content_type='image/jpeg')
+        name = read_upload_token(upload['token'])['name']
+        with mock.patch.object(type(get_storage()), 'read') as read:
+            with override_settings(IMAGE_UPLOAD_MAX_SIZE=100):
+                response = self.client.post(reverse('confirm_member_image', args=[self.member.id]), {'token': upload['token']})
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(get_storage().exists(name))
+
+            # replaced through the still valid upload URL after the confirmation
+            APIClient().put(upload['url'], make_image('JPEG'), content_type='image/jpeg')
+            with override_settings(IMAGE_UPLOAD_MAX_SIZE=100), self.assertLogs('members.schema', 'WARNING'):
+                process_uploaded_member_image(self.member.id, name)
+        read.assert_not_called()
+        self.assertFalse(get_storage().exists(name))
+
+    def test_s3_size_is_read_with_a_head_request(self):
+        with override_settings(MEMBER_STORAGE_BACKEND='members.storage.S3Storage'), mock.patch('members.storage.get_s3_client') as get_client:
+            get_client.return_value.head_object.return_value = {'ContentLength': 1024}
+            self.assertEqual(get_storage().size('members/photo.jpg'), 1024)
+        get_client.return_value.get_object.assert_not_called()
+
+    def test_local_route_is_not_registered_for_s3(self):
+        with override_settings(MEMBER_STORAGE_BACKEND='members.storage.S3Storage'):
+            reload_urlconf()
+            with self.assertRaises(NoReverseMatch):
+                reverse('local_image_upload', args=['token'])
+
+    def test_s3_upload_url_is_presigned(self):
+        with override_settings(MEMBER_STORAGE_BACKEND='members.storage.S3Storage'), mock.patch('members.storage.get_s3_client') as get_client:
+            get_client.return_value.generate_presigned_url.return_value = 'https://bucket.example/signed'
+            upload = self.request_upload().data
+        self.assertEqual(upload['url'], 'https://bucket.example/signed')
+        self.assertEqual(get_client.return_value.generate_presigned_url.call_args.args[0], 'put_object')
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root, MEMBER_STORAGE_BACKEND='members.storage.LocalFileStorage')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_derivatives_are_resized_jpegs(self):
+        image_hash, _ = store_member_image(make_image(size=(1600, 800)))
+        storage = get_storage()
+        for derivative, width in [('thumbnail', 64), ('small', 256), ('medium', 640)]:
+            image = Image.open(io.BytesIO(storage.read(get_derivative_name(image_hash, derivative))))
+            self.assertEqual((image.format, image.size), ('JPEG', (width, width // 2)))
+
+    def test_same_content_is_stored_once(self):
+        content = make_image()
+        first = store_member_image(content)
+        with mock.patch.object(type(get_storage()), 'save') as save:
+            self.assertEqual(store_member_image(content), first)
+        save.assert_not_called()
+        self.assertNotEqual(store_member_image(make_image(color='blue'))[0], first[0])
+
+    def test_rejects_content_that_is_not_an_image(self):
+        with self.assertRaises(InvalidImage):
+            store_member_image(b'<?php echo 1; ?>')
+
+
+class MemberImportTests(MemberTestCase):
+    def row(self, index, **kwargs):
+        row = {
+            'name': f'Imported {index}', 'surname': 'Member', 'mobile_number': f'98300{index:05}', 'email': f'imported{index}@example.com',
+            'member_type': Member.ORDINARY, 'joining_date': '2022-01-01',
+            'permanent_country': 'India', 'permanent_state': 'Karnataka', 'permanent_city': 'Bhatkal', 'permanent_address': 'Main Road',
+            'permanent_halqa': 'Jamia', 'current_country': 'India', 'current_state': 'Karnataka', 'current_city': 'Bhatkal',
+            'current_address': 'Main Road', 'current_halqa': 'Jamia',
+        }
+        row.update(kwargs)
+        return row
+
+    def make_csv(self, rows):
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=EXPORT_HEADERS + ['joining_date'], extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        return SimpleUploadedFile('members.csv', output.getvalue().encode(), content_type='text/csv')
+
+    def import_file(self, file, **data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('import_members'), {'file': file, **data})
+        return response, len(context.captured_queries)
+
+    def test_imports_rows_in_constant_queries(self):
+        response, small = self.import_file(self.make_csv([self.row(index) for index in range(5)]))
+        self.assertEqual(response.status_code, 201)
+        _, large = self.import_file(self.make_csv([self.row(index) for index in range(100, 150)]))
+        # SQLite caps the parameters per statement and splits big batches, but nothing is per row
+        self.assertLess(large, small + 5)
+
+        self.assertEqual(Member.objects.count(), 55)
+        member = Member.objects.get(mobile_number='9830000003')
+        self.assertEqual(member.search_document, 'imported 3 member')
+        self.assertEqual(member.address.current_halqa, 'Jamia')
+        self.assertEqual(member.membership_fee.count(), timezone.now().year - 2022 + 1)
+        self.assertEqual(len(set(Member.objects.values_list('membership_number', flat=True))), 55)
+
+    def test_rows_are_stamped_when_the_import_commits(self):
+        started = timezone.now()
+        self.import_file(self.make_csv([self.row(index) for index in range(3)]))
+        last_created = Member.objects.aggregate(last=Max('created_at'))['last']
+        self.assertGreater(last_created, started)
+        self.assertFalse(Member.objects.filter(updated_at__lt=last_created).exists())
+        self.assertFalse(MembershipFee.objects.filter(updated_at__lt=last_created).exists())
+
+    def test_chunks_commit_on_their_own(self):
+        file = self.make_csv([self.row(index) for index in range(4)])
+        bulk_create = MembershipFee.objects.bulk_create
+        calls = []
+        def fail_second_chunk(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise DatabaseError('lost connection')
+            return bulk_create(*args, **kwargs)
+        with mock.patch.object(MembershipFee.objects, 'bulk_create', side_effect=fail_second_chunk), self.assertRaises(DatabaseError):
+            MemberImporter(self.user, chunk_size=2).run(file, 'csv')
+        self.assertEqual(sorted(Member.objects.values_list('name', flat=True)), ['Imported 0', 'Imported 1'])
+        self.assertEqual(MembershipFee.objects.filter(member__name='Imported 0').count(), timezone.now().year - 2022 + 1)
+
+    def test_reports_invalid_rows(self):
+        create_member(self.user, mobile_number='9830000001')
+        rows = [
+            self.row(0),
+            self.row(1),
+            self.row(2, email='not-an-email'),
+            self.row(3, name=''),
+            self.row(4, mobile_number='9830000000'),
+        ]
+        response, _ = self.import_file(self.make_csv(rows))
+        self.assertEqual(response.data['created'], 1)
+        errors = {error['row']: set(error['errors']) for error in response.data['errors']}
+        self.assertEqual(errors, {3: {'mobile_number'}, 4: {'email'}, 5: {'name'}, 6: {'mobile_number'}})
+
+    def test_imports_xlsx(self):
+        output = io.BytesIO()
+        headers = EXPORT_HEADERS + ['joining_date']
+        workbook = xlsxwriter.Workbook(output)
+        worksheet = workbook.add_worksheet()
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        worksheet.write_row(0, 0, headers)
+        for index in range(3):
+            row = self.row(index)
+            # numbers and dates come back typed, not as text
+            row['mobile_number'] = int(row['mobile_number'])
+            worksheet.write_row(index + 1, 0, [row.get(header, '') for header in headers])
+            worksheet.write_datetime(index + 1, headers.index('joining_date'), datetime(2022, 1, 1), date_format)
+        workbook.close()
+        file = SimpleUploadedFile('members.xlsx', output.getvalue(), content_type=XLSX_CONTENT_TYPE)
+        response, _ = self.import_file(file)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Member.objects.filter(name__startswith='Imported').count(), 3)
+
+    def test_dry_run_and_command(self):
+        response, _ = self.import_file(self.make_csv([self.row(0)]), dry_run='true')
+        self.assertEqual((response.status_code, response.data['created']), (200, 1))
+        self.assertFalse(Member.objects.exists())
+
+        path = os.path.join(tempfile.mkdtemp(), 'members.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'wb') as file:
+            file.write(self.make_csv([self.row(0), self.row(1)]).read())
+        output = io.StringIO()
+        call_command('import_members', path, '--user', self.user.email, stdout=output)
+        self.assertIn('Imported 2 of 2 rows', output.getvalue())
+        self.assertEqual(Member.objects.count(), 2)
+
+
+class MembershipNumberTests(MemberTestCase):
+    def test_numbers_are_sequential(self):
+        first = create_member(self.user, mobile_number='9820000001')
+        second = create_member(self.user, mobile_number='9820000002')
+        self.assertEqual(int(second.membership_number[4:]), int(first.membership_number[4:]) + 1)
+        self.assertEqual(Member.objects.get(pk=first.pk).membership_number, first.membership_number)
+
+    def test_reserve_block(self):
+        MembershipNumberSequence.objects.filter(name='MIT').update(last_value=99998)
+        self.assertEqual(MembershipNumberSequence.objects.reserve(3), ['MIT-99999', 'MIT-100000', 'MIT-100001'])
+        self.assertEqual(create_member(self.user).membership_number, 'MIT-100002')
+
+    def test_seeds_from_existing_numbers(self):
+        MembershipNumberSequence.objects.all().delete()
+        create_member(self.user, membership_number='MIT-00041', mobile_number='9820000003')
+        create_member(self.user, membership_number='MIT-100007', mobile_number='9820000004')
+        self.assertEqual(MembershipNumberSequence.objects.reserve(), ['MIT-100008'])
+
+    def test_insert_skips_follow_up_update(self):
+        address = create_address()
+        with CaptureQueriesContext(connection) as context:
+            Member.objects.create(name='Member', surname='Test', address=address, created_by=self.user)
+        self.assertFalse(any(query['sql'].startswith('UPDATE "members_member"') for query in context.captured_queries))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs a database that accepts concurrent writers')
+class MembershipNumberConcurrencyTests(TransactionTestCase):
+    def test_concurrent_inserts_get_distinct_numbers(self):
+        user = User.objects.create_user(email='admin@example.com', password='secret', mobile_number='9000000000')
+        MembershipNumberSequence.objects.get_or_create(name='MIT')
+        threads_count, per_thread = 8, 10
+        barrier = threading.Barrier(threads_count)
+        errors = []
+
+        def insert_members():
+            try:
+                barrier.wait()
+                for _ in range(per_thread):
+                    create_member(user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=insert_members) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        numbers = list(Member.objects.values_list('membership_number', flat=True))
+        self.assertEqual(len(numbers), threads_count * per_thread)
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+
+@override_settings(SHARED_CACHE=True)
+class ClaimsAuthenticationTests(MemberTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        response = self.client.post(reverse('login'), {'email': 'admin@example.com', 'password': 'secret', 'group': 'Administrator'})
+        self.tokens = response.data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def test_warm_request_makes_no_auth_queries(self):
+        self.client.get(reverse('get_users'))
+        # only the member lookup, no user row or group queries
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('suspend_member'), {'member_id': '00000000-0000-0000-0000-000000000000'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(reverse('get_users'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('get_users')).status_code, 401)
+
+    def test_revoked_role_is_rejected(self):
+        self.assertEqual(self.client.get(reverse('get_users')).status_code, 200)
+        self.user.groups.remove(Group.objects.get(name='Administrator'))
+        self.assertEqual(self.client.get(reverse('get_users')).status_code, 401)
+
+    def test_refreshed_token_keeps_claims(self):
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.assertEqual(self.client.get(reverse('get_users')).status_code, 200)
+
+    def test_change_password(self):
+        response = self.client.post(reverse('change_password'), {'current_password': 'secret', 'new_password': 'n3w-Secret!'})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('n3w-Secret!'))
@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.urls import path
+from django.utils.module_loading import import_string
 from . import views
+from .storage import LocalFileStorage
 from rest_framework_simplejwt import views as jwt_views
 
 urlpatterns = [
@@ -18,17 +21,32 @@ urlpatterns = [
     path('delete_member/', views.delete_member, name='delete_member'),
     path('get_member/<uuid:member_id>/', views.get_member, name='get_member'),
     path('member-list/', views.members, name='member-list'),
+    path('member-changes/', views.get_member_changes, name='member_changes'),
+    path('member-cache-stats/', views.member_cache_stats, name='member_cache_stats'),
     path('get-member-by-mobile/<str:mobile_number>/', views.get_member_by_mobile, name='member_by_mobile'),
     path('get-member-by-member-id/<str:member_id>/', views.get_member_by_membership_id, name='member_by_member_id'),
+    path('import_members/', views.import_members, name='import_members'),
+    path('image_upload_url/', views.get_image_upload_url, name='image_upload_url'),
+    path('confirm_member_image/<uuid:member_id>/', views.confirm_member_image, name='confirm_member_image'),
     path('download_member_list/', views.download_member_list, name='download_member_list'),
+    path('export_jobs/', views.submit_export_job, name='submit_export_job'),
+    path('export_jobs/<uuid:job_id>/', views.get_export_job, name='get_export_job'),
+    path('export_jobs/<uuid:job_id>/download/', views.download_export_job, name='download_export_job'),
 
     # Member Suspension CRUD Operations
     path('suspend/', views.suspend_member, name='suspend_member'),
+    path('suspend/bulk/', views.bulk_suspend_members, name='bulk_suspend_members'),
+    path('lift-suspension/bulk/', views.bulk_lift_suspensions, name='bulk_lift_suspensions'),
     path('suspended-member-list/', views.get_suspended_members, name='suspended-member-list'),
     path('suspension-history/<uuid:member_id>/', views.get_suspension_history, name="suspension-history"),
 
     # Memberhip Fee Crud Operations
     path('add_membership_fee/', views.add_membership_fee, name='add_fee'),
     path('view_membership_fee/', views.get_membership_details, name='get_membership_details'),
+    path('membership_fee_arrears/', views.get_membership_arrears_report, name='membership_fee_arrears'),
     path('get_membership_fees_history/<uuid:member_id>/', views.get_membership_fees_history, name='get_membership_fees_history'),
-]
\ No newline at end of file
+]
+
+# S3 takes uploads on presigned URLs, only local storage receives them through this API
+if issubclass(import_string(settings.MEMBER_STORAGE_BACKEND), LocalFileStorage):
+    urlpatterns.append(path('local_upload/<str:token>/', views.local_image_upload, name='local_image_upload'))
@@ -1,27 +1,36 @@
 # rest api imports
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
 
 # django imports
 from django.contrib.auth.models import Group
 from django.contrib.auth import authenticate
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
-from django.http import HttpResponse
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.http import StreamingHttpResponse, FileResponse
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core import signing
+from django.utils import timezone
+from django.conf import settings
 
 # app imports
-from .models import Member, User, MembershipFee
-from .serializers import UserSerializer, MemberSerializer, ChangePasswordSerializer, CustomLoginSerializer, UserUpdateSerializer, MembershipFeeSerializer, ViewMembershipFeeSerializer
+from .models import Member, User, MembershipFee, ExportJob
+from .serializers import UserSerializer, MemberSerializer, ChangePasswordSerializer, CustomLoginSerializer, UserUpdateSerializer, MembershipFeeSerializer, ViewMembershipFeeSerializer, ExportJobSerializer, AddMembershipFeeSerializer, BulkMemberSelectionSerializer, BulkSuspendSerializer, ImageUploadRequestSerializer, ConfirmImageUploadSerializer, MemberArrearsSerializer, MemberTombstoneSerializer, SuspensionSerializer
 from .decorators import admin_required
-from .schema import get_members_corrected_data, get_membership_fee_details, MembersModulePagination
+from .authentication import is_administrator
+from .exports import stream_members_csv, write_members_xlsx, create_export_job, get_export_path, XLSX_CONTENT_TYPE, CSV_CONTENT_TYPE
+from .storage import get_storage, make_upload_token, read_upload_token
+from .tasks import submit_task
+from .cache import conditional_members_response, cache_members_response, get_response_cache, invalidate_members_cache, invalidate_member_documents, get_member_document
+from .importers import MemberImporter, IMPORT_FORMATS
+from .schema import process_uploaded_member_image, get_member_image_name, get_members_corrected_data, get_membership_fee_details, get_initial_membership_fees, get_paginator, filter_members, get_member_filters, MembersModulePagination, MembersKeysetPagination, get_membership_arrears, get_arrears_ordering, get_member_fingerprint, get_member_list_fingerprint, get_membership_fee_fingerprint, get_membership_fee_history_fingerprint, get_sync_querysets, read_sync_cursor, get_changes, get_sync_page_size, get_keyset_position, encode_cursor, SYNC_ORDERING, get_field_params, get_member_list_queryset, get_membership_fee_list_queryset
 
 # utility imports
-import xlsxwriter
-from datetime import datetime
+import io
+from datetime import timedelta
 
 @api_view(['POST'])
 def login(request):
@@ -44,11 +53,12 @@ def login(request):
 
         user = User.objects.get(email=email)
         refresh = RefreshToken.for_user(user)
+        # Claims set on the refresh token are copied into every access token derived from it
+        refresh['role'] = group
+        refresh['name'] = user.full_name
+        refresh['email'] = user.email
+        refresh['mobile'] = user.mobile_number
         access_token = refresh.access_token
-        access_token['role'] = group
-        access_token['name'] = user.full_name
-        access_token['email'] = user.email
-        access_token['mobile'] = user.mobile_number
 
         tokens = {
             'refresh': str(refresh),
@@ -78,7 +88,7 @@ def register(request):
 @permission_classes([IsAuthenticated])
 @admin_required
 def get_registered_users(request):
-    paginator = MembersModulePagination()
+    paginator = get_paginator(request)
     users = User.objects.all()
     result_page = paginator.paginate_queryset(users, request)
     serializer = UserSerializer(result_page, many=True)
@@ -106,7 +116,8 @@ def change_password(request):
         current_password = serializer.validated_data['current_password']
         new_password = serializer.validated_data['new_password']
 
-        user = request.user
+        # request.user is built from the token claims and carries no password hash
+        user = User.objects.get(pk=request.user.pk)
         if user.check_password(current_password):
             user.set_password(new_password)
             user.save()
@@ -123,23 +134,11 @@ def add_member(request):
     valid_data = get_members_corrected_data(data_dict)
     member_serializer = MemberSerializer(data=valid_data, context={'request': request, 'image': image})
     if member_serializer.is_valid():
-        member_data = member_serializer.save()
-        payment_details = []
-        for year in range(member_data.joining_date.year, datetime.now().year+1):
-            payment_data = {
-                'member': member_data.id,
-                'year': year,
-                'reference_number': '-' if member_data.member_type in ['Lifetime Member', 'Sarparast'] else None,
-                'fee_status': 'paid' if member_data.member_type in ['Lifetime Member', 'Sarparast'] else 'due',
-                'created_by': request.user.id,
-                'updated_by': request.user.id,
-            }
-            payment_details.append(payment_data)
-        serializer = MembershipFeeSerializer(data=payment_details, many=True)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(member_serializer.data, status=status.HTTP_201_CREATED)
-        return Response({"errors": "Internal Server Error"}, status=status.HTTP_206_PARTIAL_CONTENT)
+        # The member, its address and its fee ledger are created together or not at all
+        with transaction.atomic():
+            member_data = member_serializer.save()
+            MembershipFee.objects.bulk_create(get_initial_membership_fees(member_data, request.user))
+        return Response(member_serializer.data, status=status.HTTP_201_CREATED)
     return Response({"errors" : member_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
     
 @api_view(['PUT'])
@@ -150,7 +149,7 @@ def update_member(request, member_id):
     except Member.DoesNotExist:
         return Response({"errors" : "Member Not Found"}, status=status.HTTP_404_NOT_FOUND)
     
-    if 'status' in request.data and not request.user.groups.filter(name='Administrator').exists():
+    if 'status' in request.data and not is_administrator(request.user):
         return Response({"errors": "Permission denied to update 'status'"}, status=status.HTTP_403_FORBIDDEN)
 
     serializer = MemberSerializer(member, data=request.data, partial=True, context={'request_user': request.user})
@@ -159,120 +158,213 @@ def update_member(request, member_id):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response({"errors" : serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-@api_view(['GET'])
+@api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def get_member(request, member_id):
-    member = Member.objects.get(id=member_id, soft_delete=False)
-    serializer = MemberSerializer(member, many=False)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+@admin_required
+def import_members(request):
+    file = request.FILES.get('file')
+    if file is None:
+        return Response({"errors": "Upload a CSV or XLSX file as 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+    file_format = file.name.rsplit('.', 1)[-1].lower()
+    if file_format not in IMPORT_FORMATS:
+        return Response({"errors": "Only CSV and XLSX files can be imported"}, status=status.HTTP_400_BAD_REQUEST)
+    dry_run = str(request.data.get('dry_run', '')).lower() in ('true', '1')
+    report = MemberImporter(request.user, dry_run=dry_run).run(file, file_format)
+    if report['created'] and not dry_run:
+        return Response(report, status=status.HTTP_201_CREATED)
+    if report['errors']:
+        return Response(report, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report, status=status.HTTP_200_OK)
 
-@api_view(['GET'])
+@api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def members(request):
-    members = Member.objects.filter(soft_delete=False)
-    country = request.GET.get("country", None)
-    state = request.GET.get("state", None)
-    city = request.GET.get("city", None)
-    halqa = request.GET.get("halqa", None)
-    query = request.GET.get("query", None)
-    member_status = request.GET.get("status", None)
-    mobile_number = request.GET.get("mobile_number", None)
-    member_id = request.GET.get("meber_id", None)
+def get_image_upload_url(request):
+    # The client PUTs the photo straight to storage, then confirms it for a member
+    serializer = ImageUploadRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"errors": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    name = get_member_image_name(serializer.validated_data['file_name'])
+    content_type = serializer.validated_data['content_type']
+    upload = get_storage().get_upload_url(name, content_type, request)
+    upload['token'] = make_upload_token(name, content_type)
+    upload['expires_in'] = settings.IMAGE_UPLOAD_URL_EXPIRY
+    return Response(upload, status=status.HTTP_200_OK)
 
-    paginator = MembersModulePagination()
-
-    if country is not None:
-        members = members.filter(Q(address__current_country__icontains=country))
-
-    if state is not None:
-        members = members.filter(Q(address__current_state__icontains=state))
-
-    if city is not None:
-        members = members.filter(Q(address__current_city__icontains=city))
-
-    if halqa is not None:
-        members = members.filter(Q(address__current_halqa__icontains=halqa))
-
-    if query is not None:
-        members = members.filter(Q(name__icontains=query) | Q(surname__icontains=query) | Q(father_name__icontains=query))
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def confirm_member_image(request, member_id):
+    serializer = ConfirmImageUploadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"errors": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    storage = get_storage()
+    name = serializer.validated_data['token']['name']
+    # a HEAD request, the object is only read once it is known to be small enough
+    size = storage.size(name)
+    if size is None:
+        return Response({"errors": "Image has not been uploaded"}, status=status.HTTP_400_BAD_REQUEST)
+    if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        storage.delete(name)
+        return Response({"errors": f"Image is larger than {settings.IMAGE_UPLOAD_MAX_SIZE} bytes"}, status=status.HTTP_400_BAD_REQUEST)
+    image_url = storage.url(name)
+    if not Member.objects.filter(pk=member_id, soft_delete=False).update(image_url=image_url, image_hash=None, updated_at=timezone.now()):
+        return Response({"errors": "Member Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    invalidate_members_cache()
+    invalidate_member_documents([member_id])
+    # resized copies are made in the background, image_url then moves to the processed original
+    transaction.on_commit(lambda: submit_task(process_uploaded_member_image, member_id, name))
+    return Response({"image_url": image_url}, status=status.HTTP_200_OK)
 
-    if member_status is not None:
-        members = members.filter(status = member_status)
-    
-    if mobile_number is not None:
-        members = members.filter(Q(mobile_number__icontains=mobile_number.strip()))
+@api_view(['PUT'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def local_image_upload(request, token):
+    # Stand-in for a presigned S3 URL when files are stored locally, the signed token is the credential
+    try:
+        upload = read_upload_token(token)
+    except signing.BadSignature:
+        return Response({"errors": "Invalid or expired upload token"}, status=status.HTTP_403_FORBIDDEN)
+    max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+    content = b''
+    if int(request.META.get('CONTENT_LENGTH') or 0) <= max_size and request.stream is not None:
+        # never read past the limit, whatever Content-Length claimed
+        content = request.stream.read(max_size + 1)
+    if int(request.META.get('CONTENT_LENGTH') or 0) > max_size or len(content) > max_size:
+        return Response({"errors": f"Upload is larger than {max_size} bytes"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    get_storage().save(upload['name'], io.BytesIO(content), upload['content_type'])
+    return Response(status=status.HTTP_200_OK)
+
+def get_member_data(request, field, value):
+    fields, expand = get_field_params(request.GET)
+    if fields is None and expand is None:
+        return get_member_document(field, value)
+    # The cache holds whole documents, a sparse fieldset is read on its own
+    queryset = Member.objects.for_fields(*MemberSerializer.resolve_fields(fields, expand))
+    try:
+        member = queryset.get(soft_delete=False, **{field: value})
+    except (Member.DoesNotExist, Member.MultipleObjectsReturned):
+        return None
+    return MemberSerializer(member, fields=fields, expand=expand).data
 
-    if member_id is not None:
-        members = members.filter(Q(membership_number__icontains=member_id))
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_members_response(get_member_fingerprint)
+def get_member(request, member_id):
+    document = get_member_data(request, 'id', member_id)
+    if document is None:
+        return Response({"errors": "Member Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(document, status=status.HTTP_200_OK)
 
-    if len(members) == 0:
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_members_response(get_member_list_fingerprint)
+@cache_members_response('member-list')
+def members(request):
+    fields, expand = get_field_params(request.GET)
+    members = get_member_list_queryset(request.GET, *MemberSerializer.resolve_fields(fields, expand))
+    paginator = get_paginator(request)
+    result_page = paginator.paginate_queryset(members, request)
+    if not result_page:
         return Response({"errors":"No Member Found"}, status=status.HTTP_200_OK)
-    else:  # Serialize many instances
-        members = members.order_by('-created_at')
-        result_page = paginator.paginate_queryset(members, request)
-        serializer = MemberSerializer(result_page, many=True)
+    serializer = MemberSerializer(result_page, many=True, fields=fields, expand=expand)
     return paginator.get_paginated_response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_member_changes(request):
+    """
+    Members, fees and suspensions changed since `cursor`, oldest first. Clients
+    keep the returned cursor and ask again while `has_more` is true. Rows must
+    commit within SYNC_SAFETY_LAG of their updated_at to be seen.
+    """
+    cursor = read_sync_cursor(request.GET.get('cursor'))
+    page_size = get_sync_page_size(request.GET)
+    until = timezone.now() - timedelta(seconds=settings.SYNC_SAFETY_LAG)
+    serialize = {
+        'members': lambda member: (MemberTombstoneSerializer if member.soft_delete else MemberSerializer)(member).data,
+        'membership_fees': lambda fee: MembershipFeeSerializer(fee).data,
+        'suspensions': lambda suspension: SuspensionSerializer(suspension).data,
+    }
+    changes, has_more = {}, False
+    for stream, queryset in get_sync_querysets().items():
+        rows, more = get_changes(queryset, cursor.get(stream), page_size, until)
+        if rows:
+            cursor[stream] = get_keyset_position(rows[-1], SYNC_ORDERING)
+        changes[stream] = [serialize[stream](row) for row in rows]
+        has_more = has_more or more
+    return Response({**changes, 'cursor': encode_cursor(cursor), 'has_more': has_more}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@admin_required
+def member_cache_stats(request):
+    # Counted per process, each worker reports its own
+    return Response(get_response_cache().stats(), status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_member_by_mobile(request, mobile_number):
-    try:
-        member = Member.objects.get(mobile_number=mobile_number.strip(), soft_delete=False)
-        result = MemberSerializer(member, many=False)
-        return Response({"result":result.data}, status=status.HTTP_200_OK)
-    except Exception as e:
+    document = get_member_data(request, 'mobile_number', mobile_number.strip())
+    if document is None:
         return Response({"error":"Member Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"result":document}, status=status.HTTP_200_OK)
     
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_member_by_membership_id(request, member_id):
-    try:
-        member = Member.objects.get(membership_number=member_id, soft_delete=False)
-        result = MemberSerializer(member, many=False)
-        return Response({"result":result.data}, status=status.HTTP_200_OK)
-    except Exception as e:
+    document = get_member_data(request, 'membership_number', member_id.strip())
+    if document is None:
         return Response({"error":"Member Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"result":document}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 def download_member_list(request):
-    members = Member.objects.filter(soft_delete=False)
-    workbook = xlsxwriter.Workbook('members.xlsx')
-    worksheet = workbook.add_worksheet()
-    member_fields = ['name', 'surname','father_name','date_of_birth','email', 'mobile_number','qualification','profession','whatsapp_number','is_executive','is_office_bearer','member_type', 'address']
-    address_fields = ['permanent_country', 'permanent_state','permanent_city','permanent_address','permanent_halqa','current_country', 'current_state','current_city','current_address','current_halqa']
-    headers = member_fields + address_fields
-    for col_num, header in enumerate(headers):
-        print(f"col_num {col_num} and header {header}")
-        if col_num == 12:
-            continue
-        worksheet.write(0, col_num, header)
-    for row_num, member in enumerate(members, start=1):
-        for col_num, field in enumerate(headers):
-            if field == 'date_of_birth':
-                date_value = getattr(member, field)
-                formatted_date = date_value.strftime('%Y-%m-%d') if date_value else ''
-                worksheet.write(row_num, col_num, formatted_date)
-            if field == 'address':
-                address_data = getattr(member, field, None)
-
-                if address_data:
-                    for address_col, address_field in enumerate(address_fields):
-                        content = getattr(address_data, address_field, '')
-                        worksheet.write(row_num, col_num+address_col+1, content)
-                    break
-                else:
-                    for address_field in address_fields:
-                        worksheet.write(row_num, col_num, '')
-            else:
-                # For other fields, handle encoding to UTF-8
-                data = str(getattr(member, field, '')).encode('utf-8', errors='ignore').decode('utf-8')
-                worksheet.write(row_num, col_num, data)
-            
-    workbook.close()
-    with open('members.xlsx', 'rb') as excel_file:
-        response = HttpResponse(excel_file.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=members.xlsx'
-    return response
+    members = filter_members(Member.objects.filter(soft_delete=False).order_by('-created_at'), request.GET)
+    file_format = request.GET.get("file_format", "xlsx")
+    if file_format == 'csv':
+        response = StreamingHttpResponse(stream_members_csv(members), content_type=CSV_CONTENT_TYPE)
+        response['Content-Disposition'] = 'attachment; filename=members.csv'
+        return response
+    if file_format != 'xlsx':
+        return Response({"errors": "Unsupported file format"}, status=status.HTTP_400_BAD_REQUEST)
+    output = write_members_xlsx(members, io.BytesIO())
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename='members.xlsx', content_type=XLSX_CONTENT_TYPE)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def submit_export_job(request):
+    file_format = request.data.get("file_format", ExportJob.XLSX)
+    if file_format not in (ExportJob.CSV, ExportJob.XLSX):
+        return Response({"errors": "Unsupported file format"}, status=status.HTTP_400_BAD_REQUEST)
+    job, created = create_export_job(file_format, get_member_filters(request.data), request.user)
+    serializer = ExportJobSerializer(job, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_export_job(request, job_id):
+    try:
+        job = ExportJob.objects.get(pk=job_id)
+    except ExportJob.DoesNotExist:
+        return Response({"errors": "Export Job Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    serializer = ExportJobSerializer(job, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_export_job(request, job_id):
+    try:
+        job = ExportJob.objects.get(pk=job_id)
+    except ExportJob.DoesNotExist:
+        return Response({"errors": "Export Job Not Found"}, status=status.HTTP_404_NOT_FOUND)
+    if job.status != ExportJob.COMPLETED:
+        return Response({"errors": f"Export is {job.status}"}, status=status.HTTP_409_CONFLICT)
+    try:
+        artifact = open(get_export_path(job.file_name), 'rb')
+    except FileNotFoundError:
+        return Response({"errors": "Export file has expired, submit the export again"}, status=status.HTTP_410_GONE)
+    content_type = CSV_CONTENT_TYPE if job.file_format == ExportJob.CSV else XLSX_CONTENT_TYPE
+    return FileResponse(artifact, as_attachment=True, filename=f'members.{job.file_format}', content_type=content_type)
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
@@ -293,71 +385,77 @@ def delete_member(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_membership_fee(request):
-    mobile_number = request.data.get("mobile_number").strip()
-    from_year = int(request.data.get('from_year'))
-    to_year = int(request.data.get('to_year'))
-    reference_number = request.data.get('reference_number')
-    amount = float(request.data.get('amount'))
+    serializer = AddMembershipFeeSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"errors" : serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    mobile_number = serializer.validated_data['mobile_number'].strip()
+    from_year = serializer.validated_data['from_year']
+    to_year = serializer.validated_data['to_year']
+    reference_number = serializer.validated_data.get('reference_number')
+    amount = serializer.validated_data['amount']
     user = Member.objects.filter(mobile_number=mobile_number, soft_delete=False).first()
     if user is None:
         return Response({"message":"Invalid Mobile Number Or Member Does'nt Exist"}, status=status.HTTP_200_OK)
-    payments = []
-    for year in range(from_year, to_year):
-        membership_fee = MembershipFee.objects.filter(member=user, year=year).first()
-        if membership_fee is None:
-            payment_data = {
-                'member': user.id,
-                'year': year,
-                'reference_number': reference_number,
-                'amount': amount,
-                'fee_status': 'paid',
-                'created_by': request.user.id,
-                'updated_by': request.user.id,
-            }
-            payments.append(payment_data)
-        else:
-            payment_data = {
-                'fee_status': 'paid', 
-                'amount': amount, 
-                'reference_number': reference_number,
-                'updated_by': request.user.id,
-            }
-            serializer = MembershipFeeSerializer(membership_fee, data=payment_data, partial=True)
-            if serializer.is_valid():
-                serializer.save()
-            else:
-                return Response({"errors" : serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
-    # return Response({'message': "Fetched Successfully"})
-    if payments:
-        serializer = MembershipFeeSerializer(data=payments, many=True)
-        if serializer.is_valid():
-            serializer.save()
-        else:
-            return Response({"errors" : serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    payments = [
+        MembershipFee(
+            member=user,
+            year=str(year),
+            reference_number=reference_number,
+            amount=amount,
+            fee_status=MembershipFee.PAID,
+            created_by=request.user,
+            updated_by=request.user,
+        )
+        for year in range(from_year, to_year)
+    ]
+    # A single INSERT .. ON CONFLICT (member, year) DO UPDATE, years that already
+    # have a row are marked paid and keep their original creator
+    with transaction.atomic():
+        MembershipFee.objects.bulk_create(
+            payments,
+            update_conflicts=True,
+            unique_fields=['member', 'year'],
+            update_fields=['amount', 'reference_number', 'fee_status', 'updated_by', 'updated_at'],
+        )
+        # the upsert sends no post_save signals
+        invalidate_members_cache()
     return Response({"message": "Membership fees updated successfully."}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_members_response(get_membership_fee_fingerprint)
 def get_membership_details(request):
-    year = request.GET.get("year", None)
-    paginator = MembersModulePagination()
-    membership_fees = MembershipFee.objects.filter(member__soft_delete=False).order_by("-created_at")
-    if year:
-        membership_fees = membership_fees.filter(year=year)
-    if len(membership_fees) == 0:
+    paginator = get_paginator(request)
+    fields, expand = get_field_params(request.GET)
+    try:
+        membership_fees = get_membership_fee_list_queryset(request.GET, *ViewMembershipFeeSerializer.resolve_fields(fields, expand))
+    except ValidationError:
+        return Response({"errors": "Invalid member_id"}, status=status.HTTP_400_BAD_REQUEST)
+    result_page = paginator.paginate_queryset(membership_fees, request)
+    if not result_page:
         return Response({"errors":"No Member Found"}, status=status.HTTP_200_OK)
-    else:  # Serialize many instances
-        result_page = paginator.paginate_queryset(membership_fees, request)
-        serializer = ViewMembershipFeeSerializer(result_page, many=True)
+    serializer = ViewMembershipFeeSerializer(result_page, many=True, fields=fields, expand=expand)
     return paginator.get_paginated_response(serializer.data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+def get_membership_arrears_report(request):
+    ordering = get_arrears_ordering(request.GET.get('ordering'))
+    if ordering is None:
+        return Response({"errors": "Invalid ordering"}, status=status.HTTP_400_BAD_REQUEST)
+    # Always cursor paginated, a COUNT over the grouped rows would cost as much as the report
+    paginator = MembersKeysetPagination(ordering)
+    result_page = paginator.paginate_queryset(get_membership_arrears(request.GET), request)
+    serializer = MemberArrearsSerializer(result_page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_members_response(get_membership_fee_history_fingerprint)
 def get_membership_fees_history(request, member_id):
     try:
         member = Member.objects.get(id=member_id)
-        print("HEY MEMBER: ", member)
-        membership_fees = member.membership_fee.all().order_by('-year')
+        membership_fees = member.membership_fee.select_related('created_by', 'updated_by').order_by('-year')
         paginator = MembersModulePagination()
         result_page = paginator.paginate_queryset(membership_fees, request)
         results = get_membership_fee_details(result_page)
@@ -377,17 +475,50 @@ def suspend_member(request):
         return Response({"errors" : 'Member Not Found'}, status=status.HTTP_404_NOT_FOUND)
     suspended_till = request.data.get('end_date')
     suspension_reason = request.data.get('reason')
-    member.suspend(suspended_till, suspension_reason, request.user)
+    try:
+        member.suspend(suspended_till, suspension_reason, request.user)
+    except ValidationError as e:
+        return Response({"errors": e.messages}, status=status.HTTP_400_BAD_REQUEST)
     return Response({"message": f"{member.get_full_name} suspended till {suspended_till}."}, status=status.HTTP_200_OK)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@admin_required
+def bulk_suspend_members(request):
+    serializer = BulkSuspendSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"errors": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    end_date = serializer.validated_data['end_date']
+    suspended = serializer.get_members().bulk_suspend(end_date, serializer.validated_data['reason'], request.user)
+    results = [
+        {"member_id": member_id, "status": "suspended", "suspended_until": suspended_until}
+        for member_id, suspended_until in suspended.items()
+    ]
+    results += [{"member_id": member_id, "status": "not_found"} for member_id in serializer.get_missing_ids(suspended)]
+    return Response({"message": f"{len(suspended)} members suspended till {end_date}.", "results": results}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@admin_required
+def bulk_lift_suspensions(request):
+    serializer = BulkMemberSelectionSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"errors": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    lifted = serializer.get_members().bulk_lift_suspension()
+    results = [
+        {"member_id": member_id, "status": "lifted" if was_suspended else "not_suspended"}
+        for member_id, was_suspended in lifted.items()
+    ]
+    results += [{"member_id": member_id, "status": "not_found"} for member_id in serializer.get_missing_ids(lifted)]
+    return Response({"message": f"{sum(lifted.values())} suspensions lifted.", "results": results}, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_suspended_members(request):
-    paginator = MembersModulePagination()
-    current_time = datetime.now()
-    suspended_members = Member.objects.filter(
-        suspensions__end_date__gte=current_time
-    ).distinct().order_by('-created_at')
+    paginator = get_paginator(request)
+    suspended_members = Member.objects.for_listing().filter(
+        suspended_until__gte=timezone.now()
+    ).order_by('-created_at')
     result_page = paginator.paginate_queryset(suspended_members, request)
     serializer = MemberSerializer(result_page, many=True)
     return paginator.get_paginated_response(serializer.data)
@@ -397,7 +528,7 @@ def get_suspended_members(request):
 @permission_classes([IsAuthenticated])
 def get_suspension_history(request, member_id):
     try:
-        member = Member.objects.get(pk=member_id)
+        member = Member.objects.for_listing().get(pk=member_id)
     except Exception as e:
         return Response({"errors" : 'Member Not Found'}, status=status.HTTP_404_NOT_FOUND)
     serializer = MemberSerializer(member, many=False)
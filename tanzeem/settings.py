@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'rest_framework_simplejwt.token_blacklist',
@@ -64,6 +65,8 @@ MIDDLEWARE = [
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
+# Lets browser clients read the validators they send back in If-None-Match
+CORS_EXPOSE_HEADERS = ['ETag', 'Last-Modified', 'X-Cache']
 
 # CORS_ORIGIN_WHITELIST = [
 #     "http://localhost:3000",
@@ -132,10 +135,48 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = { 
 	'DEFAULT_AUTHENTICATION_CLASSES': [ 
-		'rest_framework_simplejwt.authentication.JWTAuthentication', 
+		'members.authentication.ClaimsJWTAuthentication', 
 	], 
 }
 
+# A cache shared by every process, e.g. CACHE_URL=redis://localhost:6379/0 or
+# memcached://localhost:11211. The members version, member documents and user auth
+# state live in the default cache; without a shared one those caches are turned off,
+# a per-process cache would keep serving what another worker has already changed.
+CACHE_URL = os.environ.get('CACHE_URL')
+CACHE_BACKENDS = {
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'rediss': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+if CACHE_URL:
+    scheme, _, address = CACHE_URL.partition('://')
+    CACHES = {
+        'default': {
+            'BACKEND': CACHE_BACKENDS[scheme],
+            'LOCATION': address if scheme == 'memcached' else CACHE_URL,
+        }
+    }
+SHARED_CACHE = bool(CACHE_URL)
+
+# Seconds a user's active flag and groups are cached for token authentication
+AUTH_STATE_CACHE_TIMEOUT = int(os.environ.get('AUTH_STATE_CACHE_TIMEOUT', 60))
+
+# Cached member-list responses, only with SHARED_CACHE. members.cache.LocalLRUCache keeps
+# them in each process, members.cache.DjangoCacheBackend in the MEMBER_CACHE_ALIAS cache.
+# Either way they are keyed on the members version in the shared default cache, so a
+# change made in one worker reaches the others.
+MEMBER_CACHE_BACKEND = os.environ.get('MEMBER_CACHE_BACKEND', 'members.cache.LocalLRUCache')
+MEMBER_CACHE_ALIAS = os.environ.get('MEMBER_CACHE_ALIAS', 'default')
+MEMBER_CACHE_MAX_ENTRIES = int(os.environ.get('MEMBER_CACHE_MAX_ENTRIES', 1000))
+MEMBER_CACHE_TIMEOUT = int(os.environ.get('MEMBER_CACHE_TIMEOUT', 300))
+
+# Seconds the change feed stays behind the clock, so rows stamped by transactions
+# that have not committed yet are not skipped over by a client's cursor. A row whose
+# transaction commits more than this after it was stamped is missed for good, long
+# transactions restamp their rows just before committing, see schema.touch_sync_rows
+SYNC_SAFETY_LAG = int(os.environ.get('SYNC_SAFETY_LAG', 5))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -159,6 +200,22 @@ AUTH_USER_MODEL = 'members.User'
 
 STATIC_URL = 'static/'
 MEDIA_URL = 'media/'
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
+
+# Where member photos are stored, members.storage.LocalFileStorage keeps them under MEDIA_ROOT
+MEMBER_STORAGE_BACKEND = os.environ.get('MEMBER_STORAGE_BACKEND', 'members.storage.S3Storage')
+# Seconds a presigned upload URL stays valid
+IMAGE_UPLOAD_URL_EXPIRY = int(os.environ.get('IMAGE_UPLOAD_URL_EXPIRY', 900))
+# Largest photo in bytes accepted as a direct upload, a presigned S3 PUT cannot cap
+# its size so larger objects are rejected before they are read
+IMAGE_UPLOAD_MAX_SIZE = int(os.environ.get('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024))
+
+# Background work such as member exports runs in a local thread pool,
+# set BACKGROUND_WORKERS=0 to run it inline instead
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 2))
+EXPORT_ROOT = os.environ.get('EXPORT_ROOT', BASE_DIR / 'exports')
+# Days export jobs and their files are kept, see the purge_exports command
+EXPORT_RETENTION_DAYS = int(os.environ.get('EXPORT_RETENTION_DAYS', 7))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
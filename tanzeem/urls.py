@@ -17,10 +17,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
+from django.conf import settings
+from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("", include('members.urls')),
 ]
 
-urlpatterns += staticfiles_urlpatterns()
\ No newline at end of file
+urlpatterns += staticfiles_urlpatterns()
+
+if settings.DEBUG:
+    # Photos kept by members.storage.LocalFileStorage
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)